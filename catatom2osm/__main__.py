@@ -1,8 +1,12 @@
 """CatAtom2Osm command line entry point."""
 import argparse
 import logging
+import multiprocessing
 import os
 import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
 from zipfile import BadZipfile
 
 from requests.exceptions import RequestException
@@ -61,6 +65,9 @@ def process(options):
             options.config_file = config.default_config_file
         if options.config_file:
             config.get_user_config(options.config_file)
+        if options.batch > 1 and len(options.path) > 1:
+            process_batch(options)
+            return
         qgs = QgsSingleton()
         for a_path in options.path:
             o = argparse.Namespace(**options.__dict__)
@@ -68,6 +75,95 @@ def process(options):
         qgs.exitQgis()
 
 
+def init_worker(user_values, app_level):
+    """
+    Initialize QGIS once in each batch process, logging only to files.
+
+    Args:
+        user_values (dict): configuration values (see config.get_user_values)
+        app_level (int): log level of the application
+    """
+    config.set_config(user_values)
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.addHandler(logging.NullHandler())
+    log.setLevel(logging.DEBUG)
+    log.app_level = app_level
+    QgsSingleton()
+
+
+def process_path(a_path, options):
+    """
+    Process a municipality in a batch process.
+
+    The log is written to the municipality directory.
+
+    Returns:
+        tuple: path, elapsed seconds and error message (None if success)
+    """
+    start = time.time()
+    handler = None
+    try:
+        Reader(a_path)  # Validate path before creating the log file
+        handler = logging.FileHandler(os.path.join(a_path, config.log_file))
+        handler.setLevel(logging.DEBUG)
+        handler.setFormatter(logging.Formatter(config.log_format))
+        log.addHandler(handler)
+        CatAtom2Osm.create_and_run(a_path, options)
+        error = None
+    except (BadZipfile, CatException, RequestException) as e:
+        error = e.message if getattr(e, "message", "") else str(e)
+        log.error(error)
+    except Exception as e:
+        error = "{}: {}".format(type(e).__name__, e)
+        log.exception(error)
+    finally:
+        if handler:
+            log.removeHandler(handler)
+            handler.close()
+    return (a_path, time.time() - start, error)
+
+
+def process_batch(options):
+    """Process the municipalities in options.path with a pool of processes."""
+    results = []
+    initargs = (config.get_user_values(), log.app_level)
+    with ProcessPoolExecutor(
+        options.batch,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_worker,
+        initargs=initargs,
+    ) as executor:
+        futures = [
+            executor.submit(
+                process_path, a_path, argparse.Namespace(**options.__dict__)
+            )
+            for a_path in options.path
+        ]
+        for future in as_completed(futures):
+            (a_path, elapsed, error) = future.result()
+            if error:
+                log.error(_("Failed '%s': %s"), a_path, error)
+            else:
+                log.info(_("Finished '%s'"), a_path)
+            results.append((a_path, elapsed, error))
+    results.sort(key=lambda r: options.path.index(r[0]))
+    log.info(get_summary(results))
+
+
+def get_summary(results):
+    """Return a table of timings and failures for the batch results."""
+    width = max([len(_("Path"))] + [len(a_path) for (a_path, __, __) in results])
+    row = "{:<%d}  {:>9}  {}" % width
+    lines = [_("Batch summary"), row.format(_("Path"), _("Time"), _("Result"))]
+    for (a_path, elapsed, error) in results:
+        result = _("Failed: %s") % error if error else _("Success")
+        lines.append(row.format(a_path, str(timedelta(seconds=round(elapsed))), result))
+    failed = len([r for r in results if r[2]])
+    lines.append(_("%d processed, %d failed") % (len(results), failed))
+    return "\n".join(lines)
+
+
 def run():
     parser = argparse.ArgumentParser(usage=usage)
     parser.add_argument(
@@ -157,6 +253,38 @@ def run():
         action="store_true",
         help=_("Download only"),
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        dest="jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help=_("Number of processes used to write the task files"),
+    )
+    parser.add_argument(
+        "--batch",
+        dest="batch",
+        metavar="N",
+        type=int,
+        default=1,
+        help=_("Number of municipalities processed in parallel"),
+    )
+    parser.add_argument(
+        "--checkpoint",
+        dest="checkpoint",
+        action="store_true",
+        help=_(
+            "Save the state of each stage and rerun only from the first with "
+            "changed inputs"
+        ),
+    )
+    parser.add_argument(
+        "--sample-memory",
+        dest="sample_memory",
+        action="store_true",
+        help=_("Sample the memory usage to report the peak and its stage"),
+    )
     parser.add_argument(
         "--log",
         dest="log_level",
@@ -3,10 +3,13 @@ import codecs
 import gzip
 import io
 import logging
+import multiprocessing
 import os
 import shutil
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from glob import glob
+from logging.handlers import QueueHandler, QueueListener
 
 # isort: off
 from past.builtins import basestring  # NOQA: F401 - qgis/utils.py:744: Warning
@@ -14,11 +17,25 @@ from past.builtins import basestring  # NOQA: F401 - qgis/utils.py:744: Warning
 # isort: on
 import qgis.utils
 from osgeo import gdal
-from qgis.core import QgsApplication, QgsGeometry, QgsVectorLayer
+from qgis.core import QgsApplication, QgsFeatureRequest, QgsGeometry, QgsVectorLayer
 
 from catatom2osm import cdau  # NOQA: F401 - Used in get_auxiliary_addresses
-from catatom2osm import boundary, catatom, cbcn, config, csvtools, geo, osmxml, overpass
-from catatom2osm.exceptions import CatIOError, CatValueError
+from catatom2osm import (
+    boundary,
+    catatom,
+    cbcn,
+    checkpoint,
+    config,
+    csvtools,
+    geo,
+    osmjson,
+    osmpbf,
+    osmxml,
+    overpass,
+    pgzip,
+)
+from catatom2osm.exceptions import CatConfigError, CatIOError, CatValueError
+from catatom2osm.report import RUN_KEYS
 from catatom2osm.report import instance as report
 
 qgis.utils.uninstallErrorHook()
@@ -29,6 +46,209 @@ if config.silence_gdal:
     gdal.PushErrorHandler("CPLQuietErrorHandler")
 
 tasks_folder = "tasks"
+resume_file = "resume.gpkg"
+checkpoint_folder = "checkpoint"
+checkpoint_file = "layers.gpkg"
+checkpoint_layers = ("parcel", "building", "rustic_zoning", "urban_zoning", "address")
+task_source_file = "task_source.gpkg"
+task_address_file = "task_address.osm"
+task_job = {}  # State of a process of the pool of process_tasks
+
+
+def current_osm_file(name):
+    """Return the file name of the current OSM data of name in the user format."""
+    if config.current_osm_format not in config.current_osm_formats:
+        msg = _("Format of the current OSM data '%s' is not valid")
+        raise CatConfigError(msg % config.current_osm_format)
+    return "current_{}.{}".format(name, config.current_osm_format)
+
+
+def write_osm_file(data, osm_path, threads=None):
+    """
+    Write an OSM data set to an OSM XML file.
+
+    Removes ref tags and merges duplicated nodes before. Module level function
+    to run in a process pool.
+
+    Args:
+        data (Osm): OSM data set
+        osm_path (str): output filename (compress if ends with .gz)
+        threads (int): compression threads, see pgzip.GzipWriter
+
+    Returns:
+        tuple: number of nodes, ways and relations written
+    """
+    if osm_path.endswith(".pbf"):
+        msg = _("PBF files don't keep the action of the elements: '%s'")
+        raise CatValueError(msg % os.path.basename(osm_path))
+    for e in data.elements:
+        if "ref" in e.tags:
+            del e.tags["ref"]
+    data.merge_duplicated()
+    if osm_path.endswith(".gz"):
+        file_obj = codecs.getwriter("utf-8")(
+            pgzip.GzipWriter(osm_path, threads=threads)
+        )
+    else:
+        file_obj = io.open(osm_path, "w", encoding="utf-8")
+    osmxml.serialize(file_obj, data)
+    file_obj.close()
+    return (len(data.nodes), len(data.ways), len(data.relations))
+
+
+def get_address_index(address_osm):
+    """Return the address nodes of an OSM data set grouped by 'ref' tag."""
+    address_index = defaultdict(list)
+    for ad in address_osm.nodes:
+        address_index[ad.tags["ref"]].append(ad)
+    return address_index
+
+
+def merge_address(building_osm, address_osm, address_index=None):
+    """
+    Copy address from address_osm to building_osm using 'ref' tag.
+
+    If there exists one building with the same 'ref' that an address, copy
+    the address tags to the building if it isn't a 'entrace' type address or
+    else to the entrance if there exist a node with the address coordinates
+    in the building outline.
+
+    Precondition: building.move_address deleted addresses belonging to multiple
+    buildings
+
+    Args:
+        building_osm (Osm): OSM data set with buildings
+        address_osm (Osm): OSM data set with addresses
+        address_index (dict): address nodes by 'ref' from
+            get_address_index, to reuse it for several building data sets
+    """
+    if "source:date" in address_osm.tags:
+        building_osm.tags["source:date:addr"] = address_osm.tags["source:date"]
+    if address_index is None:
+        address_index = get_address_index(address_osm)
+    building_index = defaultdict(list)
+    for bu in building_osm.elements:
+        if "ref" in bu.tags:
+            building_index[bu.tags["ref"]].append(bu)
+    md = 0
+    entrances = {}  # 'ref' of the address of each entrance node
+    for (ref, group) in building_index.items():
+        parcel_ad = []
+        entrance_count = 0
+        points = None  # outline nodes by coordinates
+        for ad in address_index.get(ref, ()):
+            entrance = None
+            if "entrance" in ad.tags:
+                if points is None:
+                    points = {}
+                    outline = set(building_osm.get_outline(group))
+                    for way in outline:
+                        for n in way.nodes:
+                            points.setdefault((n.x, n.y), n)
+                entrance = points.get((ad.x, ad.y))
+                if entrance is not None:
+                    if entrances.get(entrance, ref) != ref:
+                        # Vertex shared with a building with other address
+                        node = building_osm.Node(entrance.x, entrance.y)
+                        for way in building_osm.parents[entrance] & outline:
+                            way.replace(entrance, node)
+                        points[(ad.x, ad.y)] = node
+                        entrance = node
+                    entrances[entrance] = ref
+                    entrance.update_tags(ad.tags)
+                    entrance.tags.pop("ref", None)
+                    entrance.tags.pop("image", None)
+            if entrance is not None:
+                entrance_count += 1
+            else:
+                parcel_ad.append(ad)
+        if len(parcel_ad) == 1 and entrance_count == 0:
+            ad = parcel_ad.pop()
+            bu = group[0]
+            bu.update_tags(ad.tags)
+            bu.tags.pop("image", None)
+            bu.tags.pop("entrance", None)
+        md += len(parcel_ad)
+    if md > 0:
+        log.debug(_("Refused %d 'parcel' addresses not unique for it building"), md)
+        report.inc("not_unique_addresses", md)
+
+
+def build_task(source, label, fids, comment, options, address_osm, address_index):
+    """
+    Return the OSM data set of a task and count its statistics in the report.
+
+    Args:
+        source (BaseLayer): layer with the features of the tasks
+        label (str): task label
+        fids (list): ids of the task features
+        comment (str): comment tag of the data set
+        options: application options
+        address_osm (Osm): addresses to merge if options address and building
+        address_index (dict): address nodes by 'ref', see get_address_index
+    """
+    task_osm = source.to_osm(upload="yes", tags={"comment": comment}, fids=fids)
+    if options.address and options.building:
+        merge_address(task_osm, address_osm, address_index)
+    if options.address:
+        report.address_stats(task_osm)
+    if options.building:
+        report.cons_stats(task_osm, label)
+        report.osm_stats(task_osm)
+    return task_osm
+
+
+def init_task_job(source_class, uri, source_date, address_path, options, *args):
+    """
+    Initialize a process of the pool of process_tasks.
+
+    Args:
+        source_class (type): class of the source layer
+        uri (str): source layer to open with the 'ogr' provider
+        source_date (str): source date of the layer
+        address_path (str): OSM XML file with addresses to merge or None
+        options: application options
+        args: configuration values (see config.get_user_values), log level
+            and queue to send the log records to the main process
+    """
+    (user_values, app_level, log_queue) = args
+    config.set_config(user_values)
+    for handler in list(log.handlers):
+        log.removeHandler(handler)
+    log.addHandler(QueueHandler(log_queue))
+    log.setLevel(logging.DEBUG)
+    log.app_level = app_level
+    QgsSingleton()
+    task_job["source"] = source_class(uri, providerLib="ogr", source_date=source_date)
+    task_job["options"] = options
+    task_job["address_osm"] = None
+    task_job["address_index"] = None
+    if address_path is not None:
+        with open(address_path, "rb") as fo:
+            task_job["address_osm"] = osmxml.deserialize(fo)
+        task_job["address_index"] = get_address_index(task_job["address_osm"])
+
+
+def write_task_job(label, fids, comment, osm_path):
+    """
+    Build and write a task file in a process of the pool of process_tasks.
+
+    Returns:
+        tuple: counts from write_osm_file, and report values and tasks with
+            fixmes to add with report.add_stats
+    """
+    report.clear_stats()
+    task_osm = build_task(
+        task_job["source"],
+        label,
+        fids,
+        comment,
+        task_job["options"],
+        task_job["address_osm"],
+        task_job["address_index"],
+    )
+    counts = write_osm_file(task_osm, osm_path, threads=1)
+    return (counts, report.values, report.tasks_with_fixmes)
 
 
 class QgsSingleton(QgsApplication):
@@ -86,6 +306,8 @@ class CatAtom2Osm(object):
         self.aux_path = os.path.join(os.path.dirname(self.path), config.aux_path)
         if self.options.address and not self.options.building:
             self.source = "address"
+        self.mem_files = []
+        self.checkpoint = self.get_checkpoint()
 
     @staticmethod
     def create_and_run(a_path, options):
@@ -111,31 +333,198 @@ class CatAtom2Osm(object):
         if self.options.comment:
             self.add_comments()
             return
+        if self.options.sample_memory:
+            report.start_sampler()
+        else:
+            report.clear_sampler()
         if self.options.address and not self.is_new:
             log.info(_("Resume processing '%s'"), report.mun_code)
-            self.resume_address()
+            self.run_stages("resume_address", "process_address")
+            self.address.reproject()
         else:
             log.info(_("Start processing '%s'"), report.mun_code)
-            self.get_parcel()
-            self.get_building()
-            self.get_zoning()
+            stages = ["get_parcel", "get_building", "get_zoning"]
             if self.options.zoning:
-                self.export_poly()
-            self.process_building()
-            self.process_parcel()
+                stages.append("export_poly")
+            stages += ["process_building", "process_parcel"]
+            if self.options.address:
+                stages.append("get_address")
+            self.run_stages(*stages)
             if self.options.address:
-                self.get_address()
                 self.stop_address()
                 return
-        if self.options.address:
-            self.process_address()
-            self.address.reproject()
         if not self.options.zoning:
             self.building.reproject()
-            self.process_tasks(getattr(self, self.source))
-        self.output_zoning()
+            with report.stage("process_tasks", self):
+                self.process_tasks(getattr(self, self.source))
+        with report.stage("output_zoning", self):
+            self.output_zoning()
         self.finish()
 
+    def get_checkpoint(self):
+        """
+        Return the checkpoint store or None if the option is not enabled.
+
+        The stages depend on the hashes of the input files, the options and
+        the configuration values they use.
+        """
+        if not self.options.checkpoint or self.options.parcel:
+            return None
+        inputs = sorted(glob(self.cat.get_path(config.fn_prefix + ".*")))
+        inputs = [checkpoint.file_hash(fn) for fn in inputs]
+        options = [
+            getattr(self.options, k)
+            for k in ("building", "address", "zoning", "manual")
+        ]
+        split = None
+        if self.split:
+            split = [f.geometry().asWkt() for f in self.split.getFeatures()]
+        aux_files = sorted(glob(os.path.join(self.aux_path, "*")))
+        highway_types_path = os.path.join(config.app_path, "highway_types.csv")
+        current_address_path = self.cat.get_path(current_osm_file("address"))
+        current_highway_path = self.cat.get_path(current_osm_file("highway"))
+        stages = [
+            ("get_parcel", []),
+            ("get_building", []),
+            ("get_zoning", []),
+            (
+                "process_building",
+                [
+                    config.dup_thr,
+                    config.dist_thr,
+                    config.straight_thr,
+                    config.acute_thr,
+                    config.min_area,
+                    config.acute_inv,
+                    config.dist_inv,
+                    config.warning_min_area,
+                    config.warning_max_area,
+                ],
+            ),
+            ("process_parcel", [config.parcel_parts, config.parcel_dist]),
+            (
+                "get_address",
+                [config.aux_address] + [checkpoint.file_stat(f) for f in aux_files],
+            ),
+            (
+                "process_address",
+                [
+                    checkpoint.file_hash(self.highway_names_path),
+                    checkpoint.file_hash(highway_types_path),
+                    checkpoint.file_hash(current_address_path),
+                    checkpoint.file_hash(current_highway_path),
+                    config.addr_thr,
+                    config.entrance_thr,
+                    config.no_number,
+                    config.place_types,
+                    config.remove_place_from_name,
+                    config.lowcase_words,
+                    config.excluded_types,
+                ],
+            ),
+        ]
+        path = self.cat.get_path(checkpoint_folder)
+        return checkpoint.Checkpoint(path, stages, inputs, options, split)
+
+    def run_stages(self, *stages):
+        """
+        Run in order the methods named in stages.
+
+        With a checkpoint store, the state of the last valid stage is
+        restored skipping the previous ones, and the state is saved after
+        running each stage with a key. Stages without a key, like exports,
+        aren't saved and are skipped if a later stage is restored, their
+        output comes from the run that saved it. Each stage is profiled in
+        the report.
+        """
+        start = 0
+        if self.checkpoint is not None:
+            last = self.checkpoint.last_valid(stages)
+            if last is not None:
+                log.info(_("Resume from checkpoint '%s'"), last)
+                with report.stage("load_checkpoint", self):
+                    self.load_checkpoint(last)
+                start = stages.index(last) + 1
+        for stage in stages[start:]:
+            with report.stage(stage, self):
+                getattr(self, stage)()
+            if self.checkpoint is not None and stage in self.checkpoint.keys:
+                self.save_checkpoint(stage)
+
+    def save_checkpoint(self, stage):
+        """Save the layers, OSM data and report values after stage."""
+        path = self.checkpoint.create(stage)
+        fn = os.path.join(path, checkpoint_file)
+        source_date = {}
+        for name in checkpoint_layers:
+            layer = getattr(self, name, None)
+            if layer is not None:
+                if not layer.export(fn, "GPKG", layer_name=name):
+                    raise CatIOError(_("Failed to write layer: '%s'") % name)
+                source_date[name] = getattr(layer, "source_date", None)
+        if getattr(self, "address_osm", None) is not None:
+            fn = os.path.join(path, "address.osm")
+            with io.open(fn, "w", encoding="utf-8") as fo:
+                osmxml.serialize(fo, self.address_osm)
+        report.export(os.path.join(path, "report.json"))
+        state = {
+            "tasks": getattr(self, "tasks", None),
+            "boundary_bbox": getattr(self, "boundary_bbox", None),
+            "source_date": source_date,
+        }
+        self.checkpoint.save(stage, state)
+        log.debug(_("Saved checkpoint '%s'"), stage)
+
+    def load_checkpoint(self, stage):
+        """Restore the state saved after stage."""
+        path = self.checkpoint.get_path(stage)
+        state = self.checkpoint.load(stage)
+        report.from_file(os.path.join(path, "report.json"), keep=RUN_KEYS)
+        layers = {
+            "parcel": lambda uri: geo.ParcelLayer(
+                self.cat.zip_code, uri, providerLib="ogr"
+            ),
+            "building": lambda uri: geo.ConsLayer(uri, providerLib="ogr"),
+            "rustic_zoning": lambda uri: geo.ZoningLayer(uri, "rusticzoning", "ogr"),
+            "urban_zoning": lambda uri: geo.ZoningLayer(uri, "urbanzoning", "ogr"),
+            "address": lambda uri: geo.AddressLayer(uri, providerLib="ogr"),
+        }
+        mem_path = self.copy_to_memory(os.path.join(path, checkpoint_file))
+        for (name, source_date) in state["source_date"].items():
+            layer = layers[name](mem_path + "|layername=" + name)
+            if not layer.isValid():
+                raise CatIOError(_("Failed to load layer '%s'") % name)
+            layer.source_date = source_date
+            setattr(self, name, layer)
+        fn = os.path.join(path, "address.osm")
+        if os.path.exists(fn):
+            with open(fn, "rb") as fo:
+                self.address_osm = osmxml.deserialize(fo)
+        if state["tasks"] is not None:
+            self.tasks = state["tasks"]
+        if state["boundary_bbox"] is not None:
+            self.boundary_bbox = state["boundary_bbox"]
+        self.parcel_query = None
+        if self.split:
+            if self.split.crs() != self.parcel.crs():
+                self.split.reproject(self.parcel.crs())
+            self.parcel_query = lambda f, __: self.split.is_inside_area(f)
+
+    def copy_to_memory(self, path):
+        """
+        Copy a file to the GDAL in-memory file system and return its new path.
+
+        Layers opened from the copy with the 'ogr' provider don't need to
+        append their features to memory layers and editing them doesn't
+        modify the file.
+        """
+        relpath = os.path.relpath(path, self.path).replace("\\", "/")
+        mem_path = "/".join(("/vsimem", self.cat.zip_code, relpath))
+        with open(path, "rb") as fo:
+            gdal.FileFromMemBuffer(mem_path, fo.read())
+        self.mem_files.append(mem_path)
+        return mem_path
+
     def add_comments(self):
         """Recover missing task files metadata after JOSM editing."""
         folder = os.path.basename(self.tasks_path)
@@ -144,27 +533,27 @@ class CatAtom2Osm(object):
             log.info(_("No report found"))
             return
         report.from_file(report_path)
-        tasks = 0
+        tags = dict(config.changeset_tags)
+        tags["generator"] = report.app_version
+        if "building_date" in report.values:
+            tags["source:date"] = report.building_date
+        if "address_date" in report.values:
+            tags["source:date:addr"] = report.address_date
+        paths = []
+        task_tags = []
         for fn in os.listdir(self.tasks_path):
-            if fn.endswith(".osm") or fn.endswith(".osm.gz"):
-                tasks += 1
+            if fn.endswith((".osm", ".osm.gz")):
                 label = os.path.basename(fn).split(".")[0]
-                data = self.read_osm(folder, fn)
-                fixmes = sum([1 for e in data.elements if "fixme" in e.tags])
+                paths.append(self.cat.get_path(folder, fn))
+                task_tags.append(dict(tags, comment=self.get_task_comment(label)))
+        if not paths:
+            log.info(_("No tasks found"))
+            return
+        # Threads, the work is mostly I/O and zlib, which release the GIL
+        with ThreadPoolExecutor(self.options.jobs) as executor:
+            for fixmes in executor.map(osmxml.update_changeset, paths, task_tags):
                 if fixmes > 0:
                     log.warning(_("Check %d fixme tags"), fixmes)
-                oldtags = dict(data.tags)
-                data.tags.update(config.changeset_tags)
-                data.tags["comment"] = self.get_task_comment(label)
-                data.tags["generator"] = report.app_version
-                if "building_date" in report.values:
-                    data.tags["source:date"] = report.building_date
-                if "address_date" in report.values:
-                    data.tags["source:date:addr"] = report.address_date
-                if data.tags != oldtags:
-                    self.write_osm(data, folder, fn)
-        if not tasks:
-            log.info(_("No tasks found"))
 
     def get_split(self):
         """Get boundary file for splitting."""
@@ -261,42 +650,83 @@ class CatAtom2Osm(object):
             report.inp_parts = report.inp_features - inbu - inpo
 
     def process_tasks(self, source):
-        """Convert to osm for each task."""
+        """
+        Convert to osm for each task.
+
+        With the jobs option, the task files are built and written in a pool
+        of processes that read the source features and addresses from files
+        (see get_task_executor).
+        """
         if not os.path.exists(self.tasks_path):
             os.makedirs(self.tasks_path)
-        tasks = self.get_tasks(source)
         tasks_r = 0
         tasks_u = 0
         to_clean = []
         to_change = {}
-        for pa in self.parcel.getFeatures():
-            label = pa["localId"]
-            task = tasks.get(label, None)
-            if task is None:
-                to_clean.append(pa.id())
-                continue
-            if len(pa["zone"]) == 3:
-                tasks_r += 1
-            else:
-                tasks_u += 1
-            comment = self.get_task_comment(label)
-            task_osm = task.to_osm(upload="yes", tags={"comment": comment})
-            if self.options.address and self.options.building:
-                self.merge_address(task_osm, self.address_osm)
-            if self.options.address:
-                report.address_stats(task_osm)
-            if self.options.building:
-                report.cons_stats(task_osm, label)
-                report.osm_stats(task_osm)
-            fp = self.cat.get_path(tasks_folder, label)
-            if self.split and os.path.exists(fp + ".osm.gz"):
-                if not os.path.exists(self.bkp_path):
-                    n = len(glob(fp + "*.osm.gz"))
-                    label = f"{label}-{n}"
-                    pa["localId"] = label
-                    to_change[pa.id()] = geo.tools.get_attributes(pa)
-            self.write_osm(task_osm, tasks_folder, label + ".osm.gz")
-            del task
+        address_osm = None
+        address_index = None
+        jobs = self.options.jobs
+        executor = None
+        log_listener = None
+        pending = deque()  # task files being written
+        try:
+            if jobs > 1:
+                (source, executor, log_listener) = self.get_task_executor(source)
+            elif self.options.address and self.options.building:
+                address_osm = self.address_osm
+                address_index = get_address_index(address_osm)
+            tasks = self.get_tasks(source)
+            for pa in self.parcel.getFeatures():
+                label = pa["localId"]
+                fids = tasks.get(label, None)
+                if fids is None:
+                    to_clean.append(pa.id())
+                    continue
+                if len(pa["zone"]) == 3:
+                    tasks_r += 1
+                else:
+                    tasks_u += 1
+                comment = self.get_task_comment(label)
+                fn = label
+                fp = self.cat.get_path(tasks_folder, label)
+                if self.split and os.path.exists(fp + ".osm.gz"):
+                    if not os.path.exists(self.bkp_path):
+                        n = len(glob(fp + "*.osm.gz"))
+                        fn = f"{label}-{n}"
+                        pa["localId"] = fn
+                        to_change[pa.id()] = {pa.fieldNameIndex("localId"): fn}
+                if executor is None:
+                    task_osm = build_task(
+                        source,
+                        label,
+                        fids,
+                        comment,
+                        self.options,
+                        address_osm,
+                        address_index,
+                    )
+                    self.write_osm(task_osm, tasks_folder, fn + ".osm.gz")
+                else:
+                    osm_path = self.cat.get_path(tasks_folder, fn + ".osm.gz")
+                    future = executor.submit(
+                        write_task_job, label, fids, comment, osm_path
+                    )
+                    pending.append((osm_path, future))
+                    while len(pending) > 2 * jobs:
+                        self.add_task_result(*pending.popleft())
+            while pending:
+                self.add_task_result(*pending.popleft())
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            if log_listener is not None:
+                log_listener.stop()
+            if jobs > 1:
+                source = None  # Close the saved layer before removing it
+                for name in (task_source_file, task_address_file):
+                    fn = self.cat.get_path(name)
+                    if os.path.exists(fn):
+                        os.remove(fn)
         if to_clean:
             self.parcel.writer.deleteFeatures(to_clean)
             log.debug(_("Removed %d void parcels"), len(to_clean))
@@ -308,32 +738,71 @@ class CatAtom2Osm(object):
         report.tasks_r = tasks_r
         report.tasks_u = tasks_u
 
+    def get_task_executor(self, source):
+        """
+        Return the source layer, pool of processes and log listener.
+
+        The source layer is saved to a file and the processes open it again,
+        so the returned layer is the saved one to get the same feature ids.
+        The addresses to merge are saved to an OSM XML file. The processes
+        are spawned (not forked from this one, which runs QGIS) and get the
+        configuration values and log level. Their log records are sent to
+        the handlers of this process by the started listener.
+        """
+        fn = self.cat.get_path(task_source_file)
+        if os.path.exists(fn):
+            os.remove(fn)
+        if not source.export(fn, "GPKG", layer_name="source"):
+            raise CatIOError(_("Failed to write layer: '%s'") % task_source_file)
+        uri = fn + "|layername=source"
+        source_date = getattr(source, "source_date", None)
+        source = source.__class__(uri, providerLib="ogr", source_date=source_date)
+        address_path = None
+        if self.options.address and self.options.building:
+            address_path = self.cat.get_path(task_address_file)
+            with io.open(address_path, "w", encoding="utf-8") as fo:
+                osmxml.serialize(fo, self.address_osm)
+        context = multiprocessing.get_context("spawn")
+        log_queue = context.Queue()
+        log_listener = QueueListener(
+            log_queue, *log.handlers, respect_handler_level=True
+        )
+        initargs = (
+            source.__class__,
+            uri,
+            source_date,
+            address_path,
+            self.options,
+            config.get_user_values(),
+            log.app_level,
+            log_queue,
+        )
+        executor = ProcessPoolExecutor(
+            self.options.jobs,
+            mp_context=context,
+            initializer=init_task_job,
+            initargs=initargs,
+        )
+        log_listener.start()
+        return (source, executor, log_listener)
+
+    def add_task_result(self, osm_path, future):
+        """Add the statistics of a task written in other process and log it."""
+        (counts, values, tasks_with_fixmes) = future.result()
+        report.add_stats(values, tasks_with_fixmes)
+        self.log_osm_file(osm_path, counts)
+
     def get_tasks(self, source):
-        """Put each source feature into a task layer."""
+        """Group the ids of the source features by task label."""
         if os.path.exists(self.tasks_path):
             for fn in os.listdir(self.tasks_path):
                 if os.path.isfile(fn):
                     os.remove(os.path.join(self.tasks_path, fn))
-        tasks = {}
-        layer_class = type(source)
-        last_task = None
-        to_add = []
-        fcount = source.featureCount()
-        for i, feat in enumerate(source.getFeatures()):
+        tasks = defaultdict(list)
+        request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry)
+        for feat in source.getFeatures(request):
             localid = source.get_id(feat)
-            label = self.tasks.get(localid, localid)
-            if i == 0:
-                last_task = label
-            f = source.copy_feature(feat, {}, {})
-            if i == fcount - 1 or label == last_task:
-                to_add.append(f)
-            if i == fcount - 1 or label != last_task:
-                if last_task not in tasks:
-                    tasks[last_task] = layer_class(baseName=last_task)
-                    tasks[last_task].source_date = source.source_date
-                tasks[last_task].writer.addFeatures(to_add)
-                to_add = [f]
-            last_task = label
+            tasks[self.tasks.get(localid, localid)].append(feat.id())
         return tasks
 
     def get_zoning(self):
@@ -405,9 +874,9 @@ class CatAtom2Osm(object):
     def finish(self):
         """Generate final report."""
         options = self.options
-        if log.app_level > logging.DEBUG:
-            geo.BaseLayer.delete_shp(self.cat.get_path("parcel.shp"))
-            geo.BaseLayer.delete_shp(self.cat.get_path("building.shp"))
+        fn = self.cat.get_path(resume_file)
+        if log.app_level > logging.DEBUG and os.path.exists(fn):
+            os.remove(fn)
         if report.fixme_stats():
             log.warning(_("Check %d fixme tags"), report.fixme_count)
             fn = self.cat.get_path("review.txt")
@@ -420,8 +889,10 @@ class CatAtom2Osm(object):
         else:
             report.clean_group("building")
         report.validate()
+        report.profile_stats()
         report.to_file(self.cat.get_path("report.txt"))
         report.export(self.cat.get_path("report.json"))
+        report.export_timeline(self.cat.get_path("timeline.json"))
         self.move_project()
         log.info(_("Finished!"))
 
@@ -430,6 +901,8 @@ class CatAtom2Osm(object):
         for propname in list(self.__dict__.keys()):
             if isinstance(getattr(self, propname), QgsVectorLayer):
                 delattr(self, propname)
+        for mem_path in self.mem_files:
+            gdal.Unlink(mem_path)
 
     def get_cbcn(self):
         """Read CartoBCN addresses."""
@@ -445,8 +918,6 @@ class CatAtom2Osm(object):
         report.inp_street_names = self.address.count(unique="TN_text")
         if self.split or self.options.parcel:
             self.boundary_bbox = self.parcel.bounding_box()
-        self.export_layer(self.address, "address.geojson", target_crs_id=4326)
-        self.get_translations(self.address)
 
     def get_address(self):
         """Read Address GML dataset."""
@@ -488,8 +959,6 @@ class CatAtom2Osm(object):
         del postaldescriptor, thoroughfarename
         report.inp_zip_codes = self.address.count(unique="postCode")
         report.inp_street_names = self.address.count(unique="TN_text")
-        self.export_layer(self.address, "address.geojson", target_crs_id=4326)
-        self.get_translations(self.address)
 
     def process_address(self):
         """Fix street names, conflate and move addresses."""
@@ -507,15 +976,23 @@ class CatAtom2Osm(object):
 
     def stop_address(self):
         """Save current processing status and exits."""
-        self.export_layer(self.parcel, "parcel.shp", driver_name="ESRI Shapefile")
-        self.export_layer(self.building, "building.shp", driver_name="ESRI Shapefile")
+        if report.inp_address:
+            self.export_layer(self.address, "address.geojson", target_crs_id=4326)
+            self.get_translations(self.address)
+        fn = self.cat.get_path(resume_file)
+        if os.path.exists(fn):
+            os.remove(fn)
+        self.export_layer(self.parcel, resume_file, "GPKG", layer_name="parcel")
+        self.export_layer(self.building, resume_file, "GPKG", layer_name="building")
         self.address.reproject()
         address_osm = self.address.to_osm()
         self.write_osm(address_osm, "address.osm")
         fn = self.cat.get_path("tasks.csv")
         csvtools.dict2csv(fn, self.tasks)
+        report.profile_stats()
         report.to_file(self.cat.get_path("report.txt"))
         report.export(self.cat.get_path("report.json"))
+        report.export_timeline(self.cat.get_path("timeline.json"))
         msg = _("Generated '%s'") % self.highway_names_path
         msg += ". " + _("Please, check it and run again")
         log.info(msg)
@@ -525,20 +1002,18 @@ class CatAtom2Osm(object):
         report.from_file(self.cat.get_path("report.json"))
         fn = self.cat.get_path("tasks.csv")
         self.tasks = csvtools.csv2dict(fn, exists=True)
-        fn = self.cat.get_path("parcel.shp")
-        parcel = geo.ParcelLayer(self.cat.zip_code, fn, providerLib="ogr")
-        if not parcel.isValid() or parcel.featureCount() == 0:
+        fn = self.cat.get_path(resume_file)
+        if not os.path.exists(fn):
             raise CatValueError(_("No parcels data"))
-        self.parcel = geo.ParcelLayer(self.cat.zip_code)
-        self.parcel.append(parcel)
-        del parcel
-        fn = self.cat.get_path("building.shp")
-        building = geo.ConsLayer(fn, providerLib="ogr")
-        if not building.isValid() or building.featureCount() == 0:
+        mem_path = self.copy_to_memory(fn)
+        uri = mem_path + "|layername=parcel"
+        self.parcel = geo.ParcelLayer(self.cat.zip_code, uri, providerLib="ogr")
+        if not self.parcel.isValid() or self.parcel.featureCount() == 0:
+            raise CatValueError(_("No parcels data"))
+        uri = mem_path + "|layername=building"
+        self.building = geo.ConsLayer(uri, providerLib="ogr")
+        if not self.building.isValid() or self.building.featureCount() == 0:
             raise CatValueError(_("No buildings data"))
-        self.building = geo.ConsLayer()
-        self.building.append(building)
-        del building
         fn = self.cat.get_path("address.geojson")
         address = geo.AddressLayer(fn, providerLib="ogr")
         if not address.isValid() or address.featureCount() == 0:
@@ -561,61 +1036,6 @@ class CatAtom2Osm(object):
                 aux = reader.read(self.cat.zip_code[:2])
                 aux_source.conflate(aux, self.address, self.cat.zip_code, self.split)
 
-    def merge_address(self, building_osm, address_osm):
-        """
-        Copy address from address_osm to building_osm using 'ref' tag.
-
-        If there exists one building with the same 'ref' that an address, copy
-        the address tags to the building if it isn't a 'entrace' type address or
-        else to the entrance if there exist a node with the address coordinates
-        in the building.
-
-        Precondition: building.move_address deleted addresses belonging to multiple
-        buildings
-
-        Args:
-            building_osm (Osm): OSM data set with buildings
-            address_osm (Osm): OSM data set with addresses
-        """
-        if "source:date" in address_osm.tags:
-            building_osm.tags["source:date:addr"] = address_osm.tags["source:date"]
-        address_index = defaultdict(list)
-        building_index = defaultdict(list)
-        for bu in building_osm.elements:
-            if "ref" in bu.tags:
-                building_index[bu.tags["ref"]].append(bu)
-        for ad in address_osm.nodes:
-            if ad.tags["ref"] in building_index:
-                address_index[ad.tags["ref"]].append(ad)
-        md = 0
-        for (ref, group) in list(building_index.items()):
-            parcel_ad = []
-            entrance_count = 0
-            for ad in address_index[ref]:
-                entrance = False
-                if "entrance" in ad.tags:
-                    for w in building_osm.get_outline(group):
-                        entrance = w.search_node(ad.x, ad.y)
-                        if entrance:
-                            entrance.tags.update(ad.tags)
-                            entrance.tags.pop("ref", None)
-                            entrance.tags.pop("image", None)
-                            break
-                if entrance:
-                    entrance_count += 1
-                else:
-                    parcel_ad.append(ad)
-            if len(parcel_ad) == 1 and entrance_count == 0:
-                ad = parcel_ad.pop()
-                bu = group[0]
-                bu.tags.update(ad.tags)
-                bu.tags.pop("image", None)
-                bu.tags.pop("entrance", None)
-            md += len(parcel_ad)
-        if md > 0:
-            log.debug(_("Refused %d 'parcel' addresses not unique for it building"), md)
-            report.inc("not_unique_addresses", md)
-
     def get_translations(self, address):
         """
         Get the translate file.
@@ -659,7 +1079,9 @@ class CatAtom2Osm(object):
             'way["place"="square"]["name"]',
             'relation["place"="square"]["name"]',
         ]
-        highway_osm = self.read_osm("current_highway.osm", ql=ql)
+        highway_osm = self.read_osm(
+            current_osm_file("highway"), ql=ql, types=("way", "relation")
+        )
         highway = geo.HighwayLayer()
         highway.read_from_osm(highway_osm)
         del highway_osm
@@ -672,7 +1094,12 @@ class CatAtom2Osm(object):
             'wr["addr:street"]["addr:housenumber"][~"building"~".*"]',
             'nwr["addr:place"]["addr:housenumber"]',
         ]
-        address_osm = self.read_osm("current_address.osm", ql=ql)
+        address_osm = self.read_osm(
+            current_osm_file("address"),
+            ql=ql,
+            query=lambda tags: "addr:street" in tags or "addr:place" in tags,
+            geometry=False,
+        )
         current_address = set()
         w = 0
         report.osm_addresses = 0
@@ -702,8 +1129,8 @@ class CatAtom2Osm(object):
         if not os.path.exists(self.bkp_path):
             os.makedirs(self.bkp_path)
         move_files = [
-            "current_address.osm",
-            "current_highway.osm",
+            current_osm_file("address"),
+            current_osm_file("highway"),
             "highway_names.csv",
             "tasks.csv",
         ]
@@ -726,7 +1153,14 @@ class CatAtom2Osm(object):
             if os.path.exists(fn):
                 shutil.copy(fn, self.bkp_path)
 
-    def export_layer(self, layer, filename, driver_name="GeoJSON", target_crs_id=None):
+    def export_layer(
+        self,
+        layer,
+        filename,
+        driver_name="GeoJSON",
+        target_crs_id=None,
+        layer_name=None,
+    ):
         """
         Export a vector layer.
 
@@ -735,29 +1169,44 @@ class CatAtom2Osm(object):
             filename (str): Output filename.
             driver_name (str): name of OGR driver (or get it from filename).
             target_crs_id (int): Defaults to source CRS.
+            layer_name (str): Layer name in a multi-layer file like GPKG.
         """
         out_path = self.cat.get_path(filename)
-        if layer.export(out_path, driver_name, target_crs_id=target_crs_id):
+        if layer.export(
+            out_path, driver_name, target_crs_id=target_crs_id, layer_name=layer_name
+        ):
+            if layer_name is not None:
+                filename += "|layername=" + layer_name
             log.info(_("Generated '%s'"), filename)
         else:
             raise CatIOError(_("Failed to write layer: '%s'") % filename)
 
     def read_osm(self, *paths, **kwargs):
         """
-        Read an OSM data set from an OSM XML file.
+        Read an OSM data set from an OSM XML, PBF or Overpass JSON file.
 
-        If the file not exists, downloads data from overpass using ql query.
+        The format is chosen by the file extension (.pbf, .json or XML for
+        any other). If the file not exists, downloads data from overpass using
+        ql query.
 
         Args:
             paths (str): input filename components relative to self.path
             ql (str): Query to put in the url for overpass
+            types, query, geometry: filters for osmxml.deserialize, PBF files
+                are read without filters
 
         Returns
             Osm: OSM data set
         """
         ql = kwargs.get("ql", False)
+        filters = {
+            k: v for (k, v) in kwargs.items() if k in ("types", "query", "geometry")
+        }
         osm_path = self.cat.get_path(*paths)
         filename = os.path.basename(osm_path)
+        is_pbf = osm_path.endswith(".pbf")
+        is_json = osm_path.endswith(".json")
+        data = None
         if not os.path.exists(osm_path):
             if not ql:
                 return None
@@ -766,16 +1215,31 @@ class CatAtom2Osm(object):
             if hasattr(self, "boundary_bbox") and self.boundary_bbox:
                 query.set_search_area(self.boundary_bbox)
             query.add(ql)
+            if is_json:
+                query.output = "json"
+            xml_path = osm_path + ".xml" if is_pbf else osm_path
             if log.app_level == logging.DEBUG:
-                query.download(osm_path, log)
+                query.download(xml_path, log)
             else:
-                query.download(osm_path)
-        if osm_path.endswith(".gz"):
-            fo = gzip.open(osm_path, "rb")
-        else:
-            fo = open(osm_path, "rb")
-        data = osmxml.deserialize(fo)
-        fo.close()
+                query.download(xml_path)
+            if is_pbf:
+                with open(xml_path, "rb") as fo:
+                    data = osmxml.deserialize(fo)
+                with open(osm_path, "wb") as fo:
+                    osmpbf.serialize(fo, data)
+                os.remove(xml_path)
+        if data is None:
+            if osm_path.endswith(".gz"):
+                fo = gzip.open(osm_path, "rb")
+            else:
+                fo = open(osm_path, "rb")
+            if is_pbf:
+                data = osmpbf.deserialize(fo)
+            elif is_json:
+                data = osmjson.deserialize(fo, **filters)
+            else:
+                data = osmxml.deserialize(fo, **filters)
+            fo.close()
         if len(data.elements) == 0:
             msg = _("No OSM data were obtained from '%s'") % filename
             log.warning(msg)
@@ -799,22 +1263,11 @@ class CatAtom2Osm(object):
             paths (str): output filename components relative to self.path
                             (compress if ends with .gz)
         """
-        for e in data.elements:
-            if "ref" in e.tags:
-                del e.tags["ref"]
-        data.merge_duplicated()
         osm_path = self.cat.get_path(*paths)
-        if osm_path.endswith(".gz"):
-            file_obj = codecs.getwriter("utf-8")(gzip.open(osm_path, "w"))
-        else:
-            file_obj = io.open(osm_path, "w", encoding="utf-8")
-        osmxml.serialize(file_obj, data)
-        file_obj.close()
+        self.log_osm_file(osm_path, write_osm_file(data, osm_path))
+
+    @staticmethod
+    def log_osm_file(osm_path, counts):
+        """Log the number of nodes, ways and relations written to a file."""
         msg = _("Generated '%s': %d nodes, %d ways, %d relations")
-        log.info(
-            msg,
-            os.path.basename(osm_path),
-            len(data.nodes),
-            len(data.ways),
-            len(data.relations),
-        )
+        log.info(msg, os.path.basename(osm_path), *counts)
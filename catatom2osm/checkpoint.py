@@ -0,0 +1,125 @@
+"""Store of the processing state after each stage of the application.
+
+Each stage gets a key chained from the key of the previous one, so a change
+in the inputs or the configuration values of a stage invalidates it and all
+the following ones.
+"""
+import hashlib
+import json
+import os
+import shutil
+
+from catatom2osm import config
+
+CHUNK_SIZE = 1 << 20  # Bytes read at once to hash files
+MANIFEST = "manifest.json"
+STATE = "state.json"
+
+
+def file_hash(path):
+    """Return the SHA-1 hex digest of the file content or None if not exists."""
+    if not os.path.exists(path):
+        return None
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as fo:
+        for chunk in iter(lambda: fo.read(CHUNK_SIZE), b""):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def file_stat(path):
+    """Return name, size and modification time of a file or None if not exists."""
+    if not os.path.exists(path):
+        return None
+    st = os.stat(path)
+    return (os.path.basename(path), st.st_size, st.st_mtime_ns)
+
+
+def get_key(*values):
+    """Return the SHA-1 hex digest of the JSON representation of values."""
+    text = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+class Checkpoint(object):
+    """Directory with the state saved after each stage and a manifest."""
+
+    def __init__(self, path, stages, *values):
+        """
+        Open the store and compute the stage keys.
+
+        Args:
+            path (str): directory of the store
+            stages (list): pairs of stage name and list of values (file
+                hashes, configuration values) the stage depends on, in
+                processing order
+            values: values all the stages depend on
+        """
+        self.path = path
+        self.keys = {}
+        key = get_key(config.app_version, *values)
+        for (stage, stage_values) in stages:
+            key = get_key(key, stage, *stage_values)
+            self.keys[stage] = key
+        self.manifest = {}
+        fn = os.path.join(path, MANIFEST)
+        if os.path.exists(fn):
+            try:
+                with open(fn, "r") as fo:
+                    self.manifest = json.load(fo)
+            except ValueError:
+                self.manifest = {}
+
+    def get_path(self, stage, *paths):
+        """Return the path of a file in the directory of stage."""
+        return os.path.join(self.path, stage, *paths)
+
+    def is_valid(self, stage):
+        """Return True if stage is saved with the current key."""
+        entry = self.manifest.get(stage)
+        return (
+            entry is not None
+            and stage in self.keys
+            and entry["key"] == self.keys[stage]
+            and os.path.exists(self.get_path(stage, STATE))
+        )
+
+    def last_valid(self, stages):
+        """Return the last valid stage of the list or None."""
+        for stage in reversed(stages):
+            if self.is_valid(stage):
+                return stage
+        return None
+
+    def create(self, stage):
+        """Return an empty directory for the files of stage."""
+        path = self.get_path(stage)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        return path
+
+    def save(self, stage, state):
+        """
+        Register stage as completed, invalidating the following ones.
+
+        Args:
+            stage (str): stage name, the files are already in its directory
+            state (dict): JSON serializable values to restore
+        """
+        with open(self.get_path(stage, STATE), "w") as fo:
+            json.dump(state, fo)
+        names = list(self.keys)
+        for name in names[names.index(stage) + 1 :]:
+            if self.manifest.pop(name, None) is not None:
+                shutil.rmtree(self.get_path(name), ignore_errors=True)
+        self.manifest[stage] = {"key": self.keys[stage]}
+        fn = os.path.join(self.path, MANIFEST)
+        with open(fn + ".tmp", "w") as fo:
+            json.dump(self.manifest, fo, indent=2)
+        os.replace(fn + ".tmp", fn)
+
+    def load(self, stage):
+        """Return the state saved for stage."""
+        with open(self.get_path(stage, STATE), "r") as fo:
+            return json.load(fo)
@@ -31,6 +31,7 @@ log_level = "INFO"  # Default log level
 log_file = "catatom2osm.log"
 log_format = "%(asctime)s - %(levelname)s - %(message)s"
 show_progress_bars = True
+memory_interval = 0.2  # Seconds between samples of the memory sampler
 
 fn_prefix = "A.ES.SDGC"  # Inspire Atom file name prefix
 
@@ -632,6 +633,10 @@ default_warning_min_area = 1  # Area in m2 for small area warning
 default_warning_max_area = 30000  # Area in m2 for big area warning
 default_parcel_parts = 20  # Number of building parts to agregate parcels
 default_parcel_dist = 1000  # Distance in meters to agregate parcels
+default_compresslevel = 9  # Compression level for .gz output files
+default_compress_threads = 0  # Threads used to compress, 0 for the number of CPUs
+default_current_osm_format = "osm"  # Format of the current OSM data files
+current_osm_formats = ("osm", "pbf", "json")
 
 default_config_file = "config.yaml"
 
@@ -662,6 +667,12 @@ def get_config_comment():
         "#   Number of building parts to agregate parcels\n"
         "# parcel_dist:\n"
         "#   Distance in meters to agregate parcels\n"
+        "# compresslevel:\n"
+        "#   Compression level (1-9) for .gz output files\n"
+        "# compress_threads:\n"
+        "#   Threads used to compress, 0 for the number of CPUs\n"
+        "# current_osm_format:\n"
+        "#   Format to download and cache the current OSM data: osm pbf json\n"
     )
 
 
@@ -675,6 +686,9 @@ default_user_config = {
     "warning_max_area": default_warning_max_area,
     "parcel_parts": default_parcel_parts,
     "parcel_dist": default_parcel_dist,
+    "compresslevel": default_compresslevel,
+    "compress_threads": default_compress_threads,
+    "current_osm_format": default_current_osm_format,
     "show_progress_bars": True,
     "osm3s_servers": default_osm3s_servers,
 }
@@ -705,6 +719,11 @@ def set_config(a_config):
 set_config(default_user_config)
 
 
+def get_user_values():
+    """Return the current values of the keys of default_user_config."""
+    return {key: globals()[key] for key in default_user_config.keys()}
+
+
 def install_gettext(app_name, localedir):
     """Install internationalization services."""
     gettext.install(app_name.lower(), localedir=localedir)
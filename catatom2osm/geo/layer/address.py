@@ -59,10 +59,10 @@ class AddressLayer(BaseLayer):
         """Trim to parcel id."""
         return feat["localId"].split("_")[0].split(".")[-1]
 
-    def to_osm(self, data=None, tags={}, upload="never"):
+    def to_osm(self, data=None, tags={}, upload="never", fids=None):
         """Export to OSM."""
         return super(AddressLayer, self).to_osm(
-            translate.address_tags, data, tags=tags, upload=upload
+            translate.address_tags, data, tags=tags, upload=upload, fids=fids
         )
 
     def conflate(self, current_address):
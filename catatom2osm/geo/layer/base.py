@@ -69,12 +69,21 @@ class BaseLayer(QgsVectorLayer):
         prj = QgsProject.instance()
         return QgsCoordinateTransform(source_crs, target_crs, prj)
 
-    def writeAsVectorFormat(self, name, driver_name, target_crs=None):
+    def writeAsVectorFormat(self, name, driver_name, target_crs=None, layer_name=None):
         transform_context = QgsProject.instance().transformContext()
         save_options = QgsVectorFileWriter.SaveVectorOptions()
         save_options.driverName = driver_name
         save_options.fileEncoding = "UTF-8"
         save_options.onlySelectedFeatures = self.selectedFeatureCount() != 0
+        if layer_name is not None:
+            save_options.layerName = layer_name
+            if os.path.exists(name):
+                action = QgsVectorFileWriter.CreateOrOverwriteLayer
+                save_options.actionOnExistingFile = action
+        pk = self.writer.pkAttributeIndexes()
+        if pk and driver_name != "GPKG":
+            # Don't output the fid field of GeoPackage layers
+            save_options.attributes = [i for i in self.attributeList() if i not in pk]
         if target_crs is not None or target_crs != self.crs():
             save_options.ct = QgsCoordinateTransform(
                 self.crs(),
@@ -370,6 +379,7 @@ class BaseLayer(QgsVectorLayer):
         driver_name="ESRI Shapefile",
         overwrite=True,
         target_crs_id=None,
+        layer_name=None,
     ):
         """Write layer to file.
 
@@ -378,17 +388,23 @@ class BaseLayer(QgsVectorLayer):
             driver_name (str): Defaults to ESRI Shapefile.
             overwrite (bool): Defaults to True
             target_crs_id (int): Defaults to source CRS
+            layer_name (str): Name of the layer in a multi-layer format like
+                GPKG. Other layers of an existing file are kept and only
+                this one is overwritten.
         """
         if target_crs_id is None:
             target_crs = self.crs()
         else:
             target_crs = QgsCoordinateReferenceSystem.fromEpsgId(target_crs_id)
-        if os.path.exists(path) and overwrite:
+        if os.path.exists(path) and overwrite and layer_name is None:
             if driver_name == "ESRI Shapefile":
                 QgsVectorFileWriter.deleteShapeFile(path)
             else:
                 os.remove(path)
-        result = self.writeAsVectorFormat(path, driver_name, target_crs)
+        if layer_name is None:
+            result = self.writeAsVectorFormat(path, driver_name, target_crs)
+        else:
+            result = self.writeAsVectorFormat(path, driver_name, target_crs, layer_name)
         try:
             return result[0] == QgsVectorFileWriter.NoError
         except TypeError:
@@ -400,6 +416,7 @@ class BaseLayer(QgsVectorLayer):
         data=None,
         tags={},
         upload="never",
+        fids=None,
     ):
         """
         Export this layer to an Osm data set.
@@ -410,19 +427,23 @@ class BaseLayer(QgsVectorLayer):
             data (Osm): OSM data set to append. By default creates a new one.
             upload (str): upload attribute of the osm dataset, default 'never'
             tags (dict): tags to update config.changeset_tags
+            fids (list): ids of the features to export. By default all.
 
         Returns:
             Osm: OSM data set
         """
         if data is None:
             generator = config.app_name + " " + config.app_version
-            data = osm.Osm(upload, generator=generator)
+            data = osm.Osm(upload, generator=generator, node_pool=True)
             nodes = ways = relations = 0
         else:
             nodes = len(data.nodes)
             ways = len(data.ways)
             relations = len(data.relations)
-        for feature in self.getFeatures():
+        request = QgsFeatureRequest()
+        if fids is not None:
+            request.setFilterFids(fids)
+        for feature in self.getFeatures(request):
             geom = feature.geometry()
             e = None
             if geom.wkbType() == WKBPoint:
@@ -444,7 +465,7 @@ class BaseLayer(QgsVectorLayer):
                 log.warning(msg)
                 report.warnings.append(msg)
             if e:
-                e.tags.update(tags_translation(feature))
+                e.update_tags(tags_translation(feature))
         changeset_tags = dict(config.changeset_tags, **tags)
         for (key, value) in changeset_tags.items():
             data.tags[key] = value
@@ -83,10 +83,10 @@ class ConsLayer(PolygonLayer):
             request.setFilterFids(fids)
         super(ConsLayer, self).explode_multi_parts(request)
 
-    def to_osm(self, data=None, tags={}, upload="never"):
+    def to_osm(self, data=None, tags={}, upload="never", fids=None):
         """Export to OSM."""
         return super(ConsLayer, self).to_osm(
-            translate.building_tags, data, tags=tags, upload=upload
+            translate.building_tags, data, tags=tags, upload=upload, fids=fids
         )
 
     def index_of_parts(self):
@@ -260,6 +260,7 @@ class ConsLayer(PolygonLayer):
             new_geom = Geometry().fromPolygonXY(new_poly)
         return delete, new_geom
 
+    @report.profile
     def merge_building_parts(self):
         """
         Apply merge_adjacent_parts to each set of building and its parts.
@@ -418,6 +419,7 @@ class ConsLayer(PolygonLayer):
                         part.setGeometry(pg)
                         break
 
+    @report.profile
     def move_address(self, address):
         """
         Try to move each entrance address to the nearest point in the building outline.
@@ -556,11 +558,10 @@ class ConsLayer(PolygonLayer):
                     if delete and not conflict:
                         to_clean.add(el)
                     if not delete and conflict:
-                        el.tags["conflict"] = "yes"
+                        el.update_tags(conflict="yes")
             pbar.update()
         pbar.close()
-        for el in to_clean:
-            current_bu_osm.remove(el)
+        current_bu_osm.remove_many(to_clean)
         log.debug(
             _("Detected %d conflicts in %d buildings/pools from OSM"),
             conflicts,
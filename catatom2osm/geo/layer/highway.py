@@ -31,7 +31,7 @@ class HighwayLayer(BaseLayer):
         for r in data.relations:
             for m in r.members:
                 if m.type == "way" and "name" in r.tags:
-                    m.element.tags["name"] = r.tags["name"]
+                    m.element.update_tags(name=r.tags["name"])
         for w in data.ways:
             if "name" in w.tags:
                 points = [QgsPoint(n.x, n.y) for n in w.nodes]
@@ -158,6 +158,7 @@ class PolygonLayer(BaseLayer):
         groups = merge_groups(adjs)
         return (groups, geometries)
 
+    @report.profile
     def topology(self):
         """Add to nearest segments each vertex in a polygon layer."""
         threshold = self.dist_thr  # Distance threshold to create nodes
@@ -459,6 +460,7 @@ class PolygonLayer(BaseLayer):
             log.debug(msg, spikes, self.name())
             report.values["vertex_spike_" + self.name()] = spikes
 
+    @report.profile
     def simplify(self):
         """
         Reduce the number of vertices in a polygon layer.
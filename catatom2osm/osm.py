@@ -1,15 +1,86 @@
 """OpenStreetMap data model."""
+import logging
+import sys
 from collections import Counter, defaultdict
+from operator import attrgetter
+
+from catatom2osm import config
+
+log = logging.getLogger(config.app_name)
 
 # Number of significant decimal digits. 0 to cancel rounding. With a value
 # greater than 7, JOSM give duplicated points errors
 COOR_DIGITS = 0
 
+# Attributes other than id that must be equal to merge two elements
+merge_attrs = attrgetter(
+    "action", "visible", "version", "timestamp", "changeset", "uid", "user"
+)
+
+
+def intern_tags(tags):
+    """
+    Return a copy of tags sharing the key and value strings between elements.
+
+    The elements are objects referenced by identity from their parents and
+    the registries, so the node coordinates stay in their slots: an index
+    into a coordinates array would take as much memory as the two floats.
+    The tags repeat a few strings in most of the elements and interning
+    them is what saves memory of the data set.
+    """
+    return {
+        sys.intern(k): sys.intern(v) if type(v) is str else v for k, v in tags.items()
+    }
+
+
+class EmptyTags(dict):
+    """
+    Tags of an element without tags.
+
+    It isn't stored in the element until the first write, when it becomes
+    the tags of the element.
+    """
+
+    __slots__ = ("element",)
+
+    def __init__(self, element):
+        super().__init__()
+        self.element = element
+
+    def __setitem__(self, key, value):
+        key = sys.intern(key)
+        value = sys.intern(value) if type(value) is str else value
+        if self.element is not None:
+            if self.element._tags is None:
+                self.element._tags = self
+            else:  # swapped in by other reference to the element tags
+                self.element._tags[key] = value
+            self.element = None
+        super().__setitem__(key, value)
+
+    def update(self, *args, **kwargs):
+        for k, v in dict(*args, **kwargs).items():
+            self[k] = v
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
 
 class Osm(object):
     """Class to implement a OSM data set."""
 
-    def __init__(self, upload="never", generator=None):
+    def __init__(self, upload="never", generator=None, node_pool=False):
+        """
+        Create an empty data set.
+
+        Args:
+            upload (str): upload attribute of the data set
+            generator (str): generator attribute of the data set
+            node_pool (bool): if True, ways created from coordinates share the
+                nodes with the same coordinates
+        """
         self.upload = upload
         self.version = "0.6"
         self.generator = generator
@@ -17,6 +88,10 @@ class Osm(object):
         self.parents = defaultdict(set)
         self.elements = set()
         self.index = {}  # elements by id
+        self._nodes = {}  # ordered registries of elements by type
+        self._ways = {}
+        self._relations = {}
+        self.node_pool = {} if node_pool else None  # way vertices by coordinates
         self.tags = {}
         self.note = None
         self.meta = None
@@ -24,18 +99,18 @@ class Osm(object):
 
     @property
     def nodes(self):
-        """Return list of nodes in elements."""
-        return [e for e in self.elements if isinstance(e, Node)]
+        """Return a view of the nodes in elements in creation order."""
+        return self._nodes.keys()
 
     @property
     def ways(self):
-        """Return list of ways in elements."""
-        return [e for e in self.elements if isinstance(e, Way)]
+        """Return a view of the ways in elements in creation order."""
+        return self._ways.keys()
 
     @property
     def relations(self):
-        """Return list of relations in elements."""
-        return [e for e in self.elements if isinstance(e, Relation)]
+        """Return a view of the relations in elements in creation order."""
+        return self._relations.keys()
 
     @property
     def attrs(self):
@@ -49,6 +124,43 @@ class Osm(object):
             attrs.pop("upload")
         return attrs
 
+    def pool_node(self, p):
+        """Return the node in the pool with coordinates p or a new one."""
+        key = (p[0], p[1])
+        if COOR_DIGITS:
+            key = (round(key[0], COOR_DIGITS), round(key[1], COOR_DIGITS))
+        n = self.node_pool.get(key)
+        if n is None or n not in self._nodes or (n.x, n.y) != key:
+            n = Node(self, key)
+            self.node_pool[key] = n
+        return n
+
+    def registry(self, el):
+        """Return the registry of elements of the same type than el or None."""
+        if isinstance(el, Node):
+            return self._nodes
+        if isinstance(el, Way):
+            return self._ways
+        if isinstance(el, Relation):
+            return self._relations
+        return None
+
+    def add(self, el):
+        """Put el in elements, in the index and in the registry of its type."""
+        self.elements.add(el)
+        self.index[el.fid] = el
+        registry = self.registry(el)
+        if registry is not None:
+            registry[el] = None
+
+    def discard(self, el):
+        """Take el out of elements, the index and the registry of its type."""
+        self.elements.discard(el)
+        self.index.pop(el.fid, None)
+        registry = self.registry(el)
+        if registry is not None:
+            registry.pop(el, None)
+
     def get(self, eid, etype="n"):
         """Return element by its id."""
         eid = str(eid)
@@ -58,51 +170,110 @@ class Osm(object):
 
     def remove(self, el):
         """Remove el from element, from its parents and its orphaned children."""
-        self.elements.discard(el)
-        if el.fid in self.index:
-            del self.index[el.fid]
-        for parent in frozenset(self.parents[el]):
+        self.discard(el)
+        for parent in frozenset(self.parents.get(el, ())):
             parent.remove(el)
+        self.parents.pop(el, None)
         for child in el.childs:
             if isinstance(child, Element):
-                if self.parents[child] == set([el]):
+                parents = self.parents.get(child)
+                if parents is None:
+                    continue
+                if len(parents) == 1 and el in parents:
                     self.remove(child)
                 else:
-                    try:
-                        self.parents[child].remove(el)
-                    except KeyError:
-                        pass
+                    parents.discard(el)
+
+    def remove_many(self, elements):
+        """
+        Remove a collection of elements and their orphaned children.
+
+        Same as calling remove for each element, but each remaining parent is
+        updated only once.
+        """
+        removed = set(elements)
+        childs = {}
+        pending = [el for el in removed if not isinstance(el, Node)]
+        while pending:
+            el = pending.pop()
+            childs[el] = [c for c in el.childs if isinstance(c, Element)]
+            for child in childs[el]:
+                if child not in removed and self.parents[child] <= removed:
+                    removed.add(child)
+                    if not isinstance(child, Node):
+                        pending.append(child)
+        parents = set()
+        for el in removed:
+            self.discard(el)
+            parents.update(self.parents.pop(el, ()))
+        for el, el_childs in childs.items():
+            for child in el_childs:
+                if child not in removed:
+                    self.parents[child].discard(el)
+        parents -= removed
+        for parent in parents:
+            parent.remove_all(removed)
 
     def replace(self, n1, n2):
         """Replace n1 witn n2 in elements."""
         n1.container = None
-        self.elements.discard(n1)
         del self.index[n1.fid]
+        self.discard(n1)
         n2.container = self
-        self.elements.add(n2)
-        self.index[n2.fid] = n2
+        self.add(n2)
         self.parents[n2] = self.parents[n1]
         del self.parents[n1]
 
     def merge_duplicated(self):
-        """Merge elements with the same geometry."""
-        geomdupes = defaultdict(list)
-        for el in self.elements:
-            geomdupes[el.geometry()].append(el)
-        for geom, dupes in list(geomdupes.items()):
-            if len(dupes) > 1:
-                i = 0  # first element in dupes with different tags or id
-                while i < len(dupes) - 1 and dupes[i] == geom:
-                    i += 1  # see __eq__ method of Element
-                for el in dupes:
-                    if el is not dupes[i] and el == dupes[i]:
-                        for parent in frozenset(self.parents[el]):
-                            parent.container = self
-                            parent.replace(el, dupes[i])
-                        self.replace(el, dupes[i])
+        """
+        Merge elements with the same geometry.
+
+        Nodes, ways and relations are merged in this order, so that the
+        parents of merged elements are compared with their childs already
+        replaced. In each group of elements with the same geometry, the first
+        one with tags or existing in OSM, or else the last one, is kept and
+        the others are replaced with it if they are equal (see __eq__ method
+        of Element).
+        """
+        for registry in (self._nodes, self._ways, self._relations):
+            geomdupes = defaultdict(list)
+            for el in registry:
+                geomdupes[el.geometry()].append(el)
+            merged = {}
+            for dupes in geomdupes.values():
+                if len(dupes) > 1:
+                    target = dupes[-1]
+                    for el in dupes:
+                        if el.tags or not el.is_new():
+                            target = el
+                            break
+                    for el in dupes:
+                        if el is not target and el == target:
+                            merged[el] = target
+            if merged:
+                self.replace_all(merged)
         for way in self.ways:
             way.clean_duplicated_nodes()
 
+    def replace_all(self, merged):
+        """
+        Replace elements in a single pass.
+
+        Args:
+            merged (dict): Targets to replace each element with.
+        """
+        parents = set()
+        for el, target in merged.items():
+            el_parents = self.parents.pop(el, set())
+            self.parents[target] |= el_parents
+            parents |= el_parents
+            for child in el.childs:
+                self.parents[child].discard(el)
+            el.container = None
+            self.discard(el)
+        for parent in parents:
+            parent.replace_all(merged)
+
     def append(self, data, query=None):
         """
         Append data elements to this dataset avoiding duplicates.
@@ -161,69 +332,107 @@ class Osm(object):
 class Element(object):
     """Base class for Osm elements."""
 
+    __slots__ = (
+        "container",
+        "action",
+        "visible",
+        "_tags",
+        "version",
+        "timestamp",
+        "changeset",
+        "uid",
+        "user",
+        "id",
+    )
+    _attr_list = (
+        "id",
+        "action",
+        "visible",
+        "version",
+        "timestamp",
+        "changeset",
+        "uid",
+        "user",
+    )
+    _data_list = ()
+    type = "element"
+
+    def __init_subclass__(cls, **kwargs):
+        """Set the type of each subclass as its class name in lowercase."""
+        super().__init_subclass__(**kwargs)
+        cls.type = cls.__name__.lower()
+
     def __init__(self, container, tags={}, attrs={}):
         """Each element must belong to a container OSM dataset."""
         self.container = container
         self.action = "modify"
         self.visible = "true"
-        self.tags = dict((k, v) for (k, v) in list(tags.items()))
+        self._tags = intern_tags(tags) if tags else None
         self.version = None
         self.timestamp = None
         self.changeset = None
         self.uid = None
         self.user = None
-        self._attr_list = (
-            "id",
-            "action",
-            "visible",
-            "version",
-            "timestamp",
-            "changeset",
-            "uid",
-            "user",
-        )
-        self.attrs = dict((k, v) for (k, v) in list(attrs.items()))
+        # Node coordinates are arguments of the constructor, not attributes
+        self.set_attrs(attrs, Element._attr_list)
         if not hasattr(self, "id"):
             container.counter -= 1
             self.id = container.counter
-        container.elements.add(self)
-        container.index[self.fid] = self
+        container.add(self)
+
+    @property
+    def tags(self):
+        """Return the tags dictionary, an unstored empty one if there aren't."""
+        return EmptyTags(self) if self._tags is None else self._tags
+
+    @tags.setter
+    def tags(self, tags):
+        self._tags = intern_tags(tags) if tags else None
+
+    def update_tags(self, *args, **kwargs):
+        """Update the tags like dict.update, creating them if there aren't."""
+        tags = intern_tags(dict(*args, **kwargs))
+        if self._tags is None:
+            self._tags = tags
+        else:
+            self._tags.update(tags)
 
     def __eq__(self, other):
         """Test equality to determine if two elements could be merged."""
         if isinstance(other, self.__class__):
-            a = dict(self.__dict__)
-            b = dict(other.__dict__)
-            a.pop("container", None)
-            b.pop("container", None)
-            if other.is_new() or self.is_new():
-                a["id"] = 0
-            if other.is_new() or self.is_new():
-                b["id"] = 0
-            if b["tags"] == {}:
-                a["tags"] = {}
-            if a["tags"] == {}:
-                b["tags"] = {}
-            return a == b
-        elif self.is_new() and self.tags == {}:
+            return self.same_data(other) and self.same_attrs(other)
+        elif self.is_new() and not self._tags:
             return self.geometry() == other
         return False
 
+    def same_data(self, other):
+        """Test if other has the same type of data (coordinates, childs) as self."""
+        if self._data_list != other._data_list:
+            return False
+        return all(getattr(self, k) == getattr(other, k) for k in self._data_list)
+
+    def same_attrs(self, other):
+        """
+        Test if the attributes of other allow merging it with self.
+
+        Ids are ignored if any of the elements is new and tags are ignored if
+        any of them don't have tags.
+        """
+        if not (self.is_new() or other.is_new()) and self.id != other.id:
+            return False
+        if self._tags and other._tags and self._tags != other._tags:
+            return False
+        return merge_attrs(self) == merge_attrs(other)
+
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    def __hash__(self):
-        return id(self)
+    __hash__ = object.__hash__  # hash by identity despite __eq__
 
     def is_new(self):
         """Return true if this element is new to OSM."""
         return self.id <= 0
 
-    @property
-    def type(self):
-        """Return class name as string."""
-        return self.__class__.__name__.lower()
-
     @property
     def fid(self):
         """Return id as unique string."""
@@ -244,16 +453,24 @@ class Element(object):
     @attrs.setter
     def attrs(self, attrs):
         """Set the element attributes from a dictionary."""
+        self.set_attrs(attrs, self._attr_list)
+
+    def set_attrs(self, attrs, attr_list):
+        """Set the attributes in attr_list from a dictionary."""
         for (k, v) in attrs.items():
-            if k == "id":
-                v = int(v)
-            if k in self._attr_list:
+            if k in attr_list:
+                if k == "id":
+                    v = int(v)
                 setattr(self, k, v)
 
 
 class Node(Element):
     """Define a node as a pair of coordinates."""
 
+    __slots__ = ("x", "y")
+    _attr_list = Element._attr_list + ("lon", "lat")
+    _data_list = ("x", "y")
+
     def __init__(self, container, x, y=0, *args, **kwargs):
         """
         Construct a node.
@@ -269,7 +486,6 @@ class Node(Element):
         if COOR_DIGITS:
             self.x = round(self.x, COOR_DIGITS)
             self.y = round(self.y, COOR_DIGITS)
-        self._attr_list = self._attr_list + ("lon", "lat")
 
     def __getitem__(self, key):
         """Commodity getter. n[0], n[1] is equivalent to n.x, n.y."""
@@ -318,6 +534,9 @@ class Node(Element):
 class Way(Element):
     """Define a way as a list of nodes."""
 
+    __slots__ = ("_nodes", "_geometry", "_shoelace")
+    _data_list = ("nodes",)
+
     def __init__(self, container, nodes=[], *args, **kwargs):
         """
         Construct a way.
@@ -334,6 +553,21 @@ class Way(Element):
         for n in nodes:
             self.append(n)
 
+    @property
+    def nodes(self):
+        """Return the list of nodes."""
+        return self._nodes
+
+    @nodes.setter
+    def nodes(self, nodes):
+        self._nodes = nodes
+        self.changed()
+
+    def changed(self):
+        """Discard the cached geometry. Needed after changing nodes in place."""
+        self._geometry = None
+        self._shoelace = None
+
     @property
     def childs(self):
         """Return set of unique nodes."""
@@ -349,19 +583,25 @@ class Way(Element):
 
     def shoelace(self):
         """Return the area for a closed way or 0, + for CCW nodes, - for CW."""
-        s = 0
-        if self.is_closed():
-            for i in range(len(self.nodes) - 1):
-                n1 = self.nodes[i]
-                n2 = self.nodes[i + 1]
-                s += n1.x * n2.y - n2.x * n1.y
-        return s
+        if self._shoelace is None:
+            s = 0
+            if self.is_closed():
+                for i in range(len(self.nodes) - 1):
+                    n1 = self.nodes[i]
+                    n2 = self.nodes[i + 1]
+                    s += n1.x * n2.y - n2.x * n1.y
+            self._shoelace = s
+        return self._shoelace
 
     def append(self, n):
         """Append n to nodes."""
         if not isinstance(n, Node):
-            n = Node(self.container, n)
-        self.nodes.append(n)
+            if self.container.node_pool is None:
+                n = Node(self.container, n)
+            else:
+                n = self.container.pool_node(n)
+        self._nodes.append(n)
+        self.changed()
         self.container.parents[n].add(self)
 
     def remove(self, n):
@@ -375,27 +615,21 @@ class Way(Element):
         self.container.parents[n1].remove(self)
         self.container.parents[n2].add(self)
 
+    def remove_all(self, removed):
+        """Remove the nodes included in removed."""
+        self.nodes = [n for n in self.nodes if n not in removed]
+
+    def replace_all(self, merged):
+        """Replace each node that is a key in merged with its value."""
+        self.nodes = [merged.get(n, n) for n in self.nodes]
+
     def __eq__(self, other):
         """Test equality to determine if two elements could be merged."""
         if self.is_open():
             return super(Way, self).__eq__(other)
         elif isinstance(other, self.__class__):
-            a = dict(self.__dict__)
-            b = dict(other.__dict__)
-            a.pop("container", None)
-            b.pop("container", None)
-            if other.is_new() or self.is_new():
-                a["id"] = 0
-            if other.is_new() or self.is_new():
-                b["id"] = 0
-            if b["tags"] == {}:
-                a["tags"] = {}
-            if a["tags"] == {}:
-                b["tags"] = {}
-            a["nodes"] = self.geometry()
-            b["nodes"] = other.geometry()
-            return a == b
-        elif self.is_new() and self.tags == {}:
+            return self.same_attrs(other) and self.geometry() == other.geometry()
+        elif self.is_new() and not self._tags:
             if hasattr(other, "index"):
                 i = other.index(min(other))
                 return self.geometry() == other[i:] + other[1 : i + 1]
@@ -404,18 +638,19 @@ class Way(Element):
     def __ne__(self, other):
         return not self.__eq__(other)
 
-    def __hash__(self):
-        return id(self)
+    __hash__ = object.__hash__  # hash by identity despite __eq__
 
     def geometry(self):
-        """Return tuple of coordinates."""
-        g = tuple(n.geometry() for n in self.nodes)
-        if self.is_closed():
-            i = g.index(min(g))
-            g = g[i:] + g[1 : i + 1]
-            if self.shoelace() < 0:
-                g = g[::-1]
-        return g
+        """Return tuple of coordinates, rotated and CCW oriented if closed."""
+        if self._geometry is None:
+            g = tuple(n.geometry() for n in self.nodes)
+            if self.is_closed():
+                i = g.index(min(g))
+                g = g[i:] + g[1 : i + 1]
+                if self.shoelace() < 0:
+                    g = g[::-1]
+            self._geometry = g
+        return self._geometry
 
     def clean_duplicated_nodes(self):
         """Remove consecutive duplicated nodes."""
@@ -446,6 +681,9 @@ class Way(Element):
 class Relation(Element):
     """A relation is a collection of nodes, ways or relations with a role."""
 
+    __slots__ = ("members",)
+    _data_list = ("members",)
+
     def __init__(self, container, members=[], *args, **kwargs):
         super(Relation, self).__init__(container, *args, **kwargs)
         self.members = []
@@ -477,6 +715,17 @@ class Relation(Element):
         self.container.parents[e1].remove(self)
         self.container.parents[e2].add(self)
 
+    def remove_all(self, removed):
+        """Remove the members whose element is included in removed."""
+        self.members = [m for m in self.members if m.element not in removed]
+
+    def replace_all(self, merged):
+        """Replace each member element that is a key in merged with its value."""
+        self.members = [
+            Relation.Member(merged[m.element], m.role) if m.element in merged else m
+            for m in self.members
+        ]
+
     def is_valid_multipolygon(self):
         """Return true if this is valid as a multipolygon relation."""
         ends = []
@@ -496,30 +745,45 @@ class Relation(Element):
         return tuple(m.element.geometry() for m in self.members)
 
     def outer_geometry(self):
-        """Return equivalent geometry removing inner rings."""
+        """
+        Return equivalent geometry removing inner rings.
+
+        The outer ways are joined by their end points. The rings that can't
+        be closed are logged and excluded.
+        """
         if not self.is_valid_multipolygon():
             return []
         outer = [m.element.geometry() for m in self.members if m.role == "outer"]
-        i = 0
-        while i < len(outer):
-            w1 = outer[i]
-            if len(w1) > 1 and w1[0] != w1[-1]:
-                match = True
-                while match:
-                    match = False
-                    for w2 in frozenset(outer[i + 1 :]):
-                        w1 = outer[i]
-                        if len(w2) > 1 and w2[0] != w2[-1]:
-                            if w2[0] == w1[-1]:
-                                outer[i] = w1 + w2[1:]
-                                outer.remove(w2)
-                                match = True
-                            elif w2[-1] == w1[-1]:
-                                outer[i] = w1 + w2[-2::-1]
-                                outer.remove(w2)
-                                match = True
-            i += 1
-        return outer
+        ends = defaultdict(list)  # open ways by their end points
+        for i, w in enumerate(outer):
+            if w[0] != w[-1]:
+                ends[w[0]].append(i)
+                ends[w[-1]].append(i)
+        joined = set()
+        rings = []
+        unclosed = 0
+        for i, w in enumerate(outer):
+            if i in joined:
+                continue
+            joined.add(i)
+            ring = list(w)
+            tail = ring[-1]
+            while ring[0] != tail:
+                j = next((j for j in ends[tail] if j not in joined), None)
+                if j is None:
+                    break
+                joined.add(j)
+                w = outer[j]
+                ring += w[1:] if w[0] == tail else w[-2::-1]
+                tail = ring[-1]
+            if ring[0] == tail:
+                rings.append(tuple(ring))
+            else:
+                unclosed += 1
+        if unclosed:
+            msg = _("Relation %s has %d unclosed outer rings")
+            log.warning(msg, self.fid, unclosed)
+        return rings
 
     def copyto(self, container):
         """Copy self in another container."""
@@ -533,6 +797,8 @@ class Relation(Element):
     class Member(object):
         """An element is member of a relation with a role."""
 
+        __slots__ = ("element", "role")
+
         def __init__(self, element, role=None):
             self.element = element
             self.role = role
@@ -540,7 +806,7 @@ class Relation(Element):
         def __eq__(self, other):
             """Test equality to determine if two elements could be merged."""
             if isinstance(other, self.__class__):
-                return self.__dict__ == other.__dict__
+                return self.element == other.element and self.role == other.role
             else:
                 return False
 
@@ -570,9 +836,11 @@ class Relation(Element):
 class Polygon(Relation):
     """Helper to create a multipolygon type relation with only one outer ring."""
 
+    __slots__ = ()
+
     def __init__(self, container, rings=[], *args, **kwargs):
         super(Polygon, self).__init__(container, *args, **kwargs)
-        self.tags["type"] = "multipolygon"
+        self.update_tags(type="multipolygon")
         role = "outer"
         for ring in rings:
             if isinstance(ring, Way):
@@ -585,6 +853,8 @@ class Polygon(Relation):
 class MultiPolygon(Polygon):
     """Helper to create a multipolygon type relation."""
 
+    __slots__ = ()
+
     def __init__(self, container, parts=[], *args, **kwargs):
         super(MultiPolygon, self).__init__(container, *args, **kwargs)
         for part in parts:
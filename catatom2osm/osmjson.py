@@ -0,0 +1,64 @@
+"""Overpass API JSON format reader."""
+import json
+
+from catatom2osm import osm
+from catatom2osm.osmxml import resolve_refs
+
+ATTRS = ("version", "timestamp", "changeset", "uid", "user")
+
+
+def get_attrs(elem):
+    """Return the attributes of an element as in OSM XML."""
+    attrs = {k: str(elem[k]) for k in ATTRS if k in elem}
+    attrs["id"] = elem["id"]
+    return attrs
+
+
+def deserialize(infile, data=None, types=None, query=None, geometry=True):
+    """
+    Generate a OSM data set from Overpass JSON or append to existing data.
+
+    The arguments are the same as in osmxml.deserialize.
+    """
+    if data is None:
+        data = osm.Osm()
+    types = ("node", "way", "relation") if types is None else tuple(types)
+    refs = {"n": {}, "w": {}, "r": {}}  # elements of this file by type and id
+    coords = None  # coordinates of excluded nodes by id
+    if geometry and "way" in types and ("node" not in types or query):
+        coords = {}
+    ways = []
+    relations = []
+    root = json.load(infile)
+    if "version" in root:
+        data.version = str(root["version"])
+    data.generator = root.get("generator")
+    elements = root.pop("elements", [])
+    for (i, elem) in enumerate(elements):
+        elements[i] = None  # release parsed elements as soon as possible
+        etype = elem["type"]
+        tags = elem.get("tags", {})
+        skip = etype not in types or (query is not None and not query(tags))
+        if etype == "node":
+            if not skip:
+                n = data.Node(elem["lon"], elem["lat"], tags, get_attrs(elem))
+                refs["n"][n.id] = n
+            elif coords is not None:
+                coords[elem["id"]] = (elem["lon"], elem["lat"])
+        elif etype == "way" and not skip:
+            w = data.Way(tags=tags, attrs=get_attrs(elem))
+            if geometry:
+                w.nodes = elem.get("nodes", [])
+                ways.append(w)
+            refs["w"][w.id] = w
+        elif etype == "relation" and not skip:
+            r = data.Relation(tags=tags, attrs=get_attrs(elem))
+            if geometry:
+                r.members = [
+                    (m["type"], m["ref"], m.get("role"))
+                    for m in elem.get("members", [])
+                ]
+                relations.append(r)
+            refs["r"][r.id] = r
+    resolve_refs(data, refs, ways, relations, coords)
+    return data
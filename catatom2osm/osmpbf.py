@@ -0,0 +1,451 @@
+"""
+OSM PBF format serializer.
+
+Pure Python implementation of the protocol buffers messages of the format.
+Coordinates are stored with the usual precision of 1e-7 degrees. The PBF
+format has no place for the 'action' and 'visible' attributes, the note,
+meta and changeset elements or the upload attribute of the data set.
+"""
+import calendar
+import struct
+import time
+import zlib
+
+from catatom2osm import config, osm
+from catatom2osm.osmxml import resolve_refs
+
+BLOCK_SIZE = 8000  # maximum number of elements in a block
+GRANULARITY = 100  # in nanodegrees
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+MEMBER_TYPES = ("node", "way", "relation")
+
+
+def encode_varint(value, out):
+    """Append to out the varint encoding of an unsigned or int64 value."""
+    if value < 0:
+        value += 1 << 64
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def zigzag(value):
+    """Map a signed integer to an unsigned one (sint64)."""
+    return (value << 1) ^ (value >> 63)
+
+
+def unzigzag(value):
+    """Map an unsigned integer to a signed one (sint64)."""
+    return (value >> 1) ^ -(value & 1)
+
+
+def encode_key(field, wire_type, out):
+    encode_varint((field << 3) | wire_type, out)
+
+
+def encode_int(field, value, out):
+    """Append a varint field."""
+    encode_key(field, 0, out)
+    encode_varint(value, out)
+
+
+def encode_bytes(field, value, out):
+    """Append a length delimited field."""
+    encode_key(field, 2, out)
+    encode_varint(len(value), out)
+    out += value
+
+
+def encode_packed(field, values, out, signed=False, delta=False):
+    """Append a packed repeated varint field, optionally zigzag/delta coded."""
+    if not values:
+        return
+    buf = bytearray()
+    last = 0
+    for value in values:
+        if delta:
+            value, last = value - last, value
+        encode_varint(zigzag(value) if signed else value, buf)
+    encode_bytes(field, buf, out)
+
+
+def decode_varint(buf, pos):
+    """Return the varint value in buf at pos and the position after it."""
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if b < 0x80:
+            return result, pos
+        shift += 7
+
+
+def decode_int64(value):
+    """Return the signed value of a decoded int64 varint."""
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def decode_message(buf):
+    """Return a dictionary of lists of values by field number."""
+    fields = {}
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = decode_varint(buf, pos)
+        wire_type = key & 7
+        if wire_type == 0:
+            value, pos = decode_varint(buf, pos)
+        elif wire_type == 2:
+            size, pos = decode_varint(buf, pos)
+            value = buf[pos : pos + size]
+            pos += size
+        elif wire_type == 1:
+            value = buf[pos : pos + 8]
+            pos += 8
+        elif wire_type == 5:
+            value = buf[pos : pos + 4]
+            pos += 4
+        else:
+            raise ValueError("Unsupported protocol buffers wire type")
+        fields.setdefault(key >> 3, []).append(value)
+    return fields
+
+
+def decode_packed(buf, signed=False, delta=False):
+    """Return the list of values of a packed repeated varint field."""
+    values = []
+    pos = 0
+    end = len(buf)
+    last = 0
+    while pos < end:
+        value, pos = decode_varint(buf, pos)
+        if signed:
+            value = unzigzag(value)
+        if delta:
+            value += last
+            last = value
+        values.append(value)
+    return values
+
+
+class StringTable(object):
+    """Strings of a primitive block. The first one is reserved."""
+
+    def __init__(self):
+        self.strings = {"": 0}
+
+    def index(self, value):
+        if value not in self.strings:
+            self.strings[value] = len(self.strings)
+        return self.strings[value]
+
+    def encode(self, out):
+        buf = bytearray()
+        for value in self.strings:
+            encode_bytes(1, value.encode("utf-8"), buf)
+        encode_bytes(1, buf, out)
+
+
+def int_attr(value):
+    """Return an element attribute as integer, 0 if not set."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def timestamp_attr(value):
+    """Return seconds since epoch of a timestamp attribute, 0 if not set."""
+    try:
+        return calendar.timegm(time.strptime(value, TIMESTAMP_FORMAT))
+    except (TypeError, ValueError):
+        return 0
+
+
+def encode_info(el, table, out):
+    """Append the info message of el if it has a version."""
+    if el.version is None:
+        return
+    buf = bytearray()
+    encode_int(1, int_attr(el.version), buf)
+    encode_int(2, timestamp_attr(el.timestamp), buf)
+    encode_int(3, int_attr(el.changeset), buf)
+    encode_int(4, int_attr(el.uid), buf)
+    encode_int(5, table.index(el.user or ""), buf)
+    encode_bytes(4, buf, out)
+
+
+def encode_tags(el, table, out):
+    """Append the keys and values of the tags of el."""
+    if el._tags:
+        keys = [table.index(k) for k in el._tags.keys()]
+        values = [table.index(str(v)) for v in el._tags.values()]
+        encode_packed(2, keys, out)
+        encode_packed(3, values, out)
+
+
+def encode_dense(nodes, table):
+    """Return a primitive group with nodes as dense nodes."""
+    buf = bytearray()
+    encode_packed(1, [n.id for n in nodes], buf, signed=True, delta=True)
+    if any(n.version is not None for n in nodes):
+        info = bytearray()
+        encode_packed(1, [int_attr(n.version) for n in nodes], info)
+        times = [timestamp_attr(n.timestamp) for n in nodes]
+        encode_packed(2, times, info, signed=True, delta=True)
+        changesets = [int_attr(n.changeset) for n in nodes]
+        encode_packed(3, changesets, info, signed=True, delta=True)
+        encode_packed(4, [int_attr(n.uid) for n in nodes], info, True, True)
+        users = [table.index(n.user or "") for n in nodes]
+        encode_packed(5, users, info, signed=True, delta=True)
+        encode_bytes(5, info, buf)
+    lats = [round(n.y * 1e9 / GRANULARITY) for n in nodes]
+    lons = [round(n.x * 1e9 / GRANULARITY) for n in nodes]
+    encode_packed(8, lats, buf, signed=True, delta=True)
+    encode_packed(9, lons, buf, signed=True, delta=True)
+    if any(n._tags for n in nodes):
+        keys_vals = []
+        for n in nodes:
+            for (k, v) in (n._tags or {}).items():
+                keys_vals.append(table.index(k))
+                keys_vals.append(table.index(str(v)))
+            keys_vals.append(0)
+        encode_packed(10, keys_vals, buf)
+    group = bytearray()
+    encode_bytes(2, buf, group)
+    return group
+
+
+def encode_way(way, table):
+    """Return a way message."""
+    buf = bytearray()
+    encode_int(1, way.id, buf)
+    encode_tags(way, table, buf)
+    encode_info(way, table, buf)
+    encode_packed(8, [n.id for n in way.nodes], buf, signed=True, delta=True)
+    return buf
+
+
+def encode_relation(rel, table):
+    """Return a relation message."""
+    buf = bytearray()
+    encode_int(1, rel.id, buf)
+    encode_tags(rel, table, buf)
+    encode_info(rel, table, buf)
+    encode_packed(8, [table.index(m.role or "") for m in rel.members], buf)
+    refs = [m.ref for m in rel.members]
+    encode_packed(9, refs, buf, signed=True, delta=True)
+    encode_packed(10, [MEMBER_TYPES.index(m.type) for m in rel.members], buf)
+    return buf
+
+
+def write_blob(outfile, blob_type, data):
+    """Write a file block compressing data."""
+    blob = bytearray()
+    encode_int(2, len(data), blob)
+    encode_bytes(3, zlib.compress(bytes(data)), blob)
+    header = bytearray()
+    encode_bytes(1, blob_type.encode(), header)
+    encode_int(3, len(blob), header)
+    outfile.write(struct.pack(">I", len(header)))
+    outfile.write(header)
+    outfile.write(blob)
+
+
+def write_block(outfile, groups, table):
+    """Write a primitive block."""
+    block = bytearray()
+    table.encode(block)
+    for group in groups:
+        encode_bytes(2, group, block)
+    write_blob(outfile, "OSMData", block)
+
+
+def serialize(outfile, data):
+    """Output PBF for an OSM data set to a binary file."""
+    header = bytearray()
+    encode_bytes(4, b"OsmSchema-V0.6", header)
+    encode_bytes(4, b"DenseNodes", header)
+    generator = data.generator or config.app_name
+    encode_bytes(16, generator.encode("utf-8"), header)
+    write_blob(outfile, "OSMHeader", header)
+    nodes = list(data.nodes)
+    for i in range(0, len(nodes), BLOCK_SIZE):
+        table = StringTable()
+        group = encode_dense(nodes[i : i + BLOCK_SIZE], table)
+        write_block(outfile, [group], table)
+    for (elements, field, encode) in (
+        (list(data.ways), 3, encode_way),
+        (list(data.relations), 4, encode_relation),
+    ):
+        for i in range(0, len(elements), BLOCK_SIZE):
+            table = StringTable()
+            group = bytearray()
+            for el in elements[i : i + BLOCK_SIZE]:
+                encode_bytes(field, encode(el, table), group)
+            write_block(outfile, [group], table)
+
+
+def read_blobs(infile):
+    """Generate the type and uncompressed data of each file block."""
+    while True:
+        size = infile.read(4)
+        if len(size) < 4:
+            return
+        header = decode_message(infile.read(struct.unpack(">I", size)[0]))
+        blob = decode_message(infile.read(header[3][0]))
+        if 1 in blob:
+            data = bytes(blob[1][0])
+        elif 3 in blob:
+            data = zlib.decompress(blob[3][0])
+        else:
+            raise ValueError("Unsupported PBF compression")
+        yield bytes(header[1][0]).decode(), data
+
+
+def to_timestamp(value, date_granularity):
+    """Return the timestamp attribute for a value in date_granularity ms units."""
+    return time.strftime(
+        TIMESTAMP_FORMAT, time.gmtime(value * date_granularity // 1000)
+    )
+
+
+def decode_attrs(fields, strings, date_granularity):
+    """Return the attributes dictionary of an info message."""
+    attrs = {}
+    if 4 in fields:
+        info = decode_message(fields[4][0])
+        if info.get(1, [0])[0]:
+            attrs["version"] = str(info[1][0])
+        if info.get(2, [0])[0]:
+            attrs["timestamp"] = to_timestamp(
+                decode_int64(info[2][0]), date_granularity
+            )
+        if info.get(3, [0])[0]:
+            attrs["changeset"] = str(decode_int64(info[3][0]))
+        if info.get(4, [0])[0]:
+            attrs["uid"] = str(info[4][0])
+        if info.get(5, [0])[0]:
+            attrs["user"] = strings[info[5][0]]
+    return attrs
+
+
+def decode_tags(fields, strings):
+    """Return the tags of a way or relation message."""
+    keys = decode_packed(fields[2][0]) if 2 in fields else []
+    values = decode_packed(fields[3][0]) if 3 in fields else []
+    return {strings[k]: strings[v] for (k, v) in zip(keys, values)}
+
+
+def decode_dense(dense, strings, offsets, data):
+    """Create the nodes of a dense nodes message."""
+    (granularity, lat_offset, lon_offset, date_granularity) = offsets
+    ids = decode_packed(dense[1][0], signed=True, delta=True)
+    lats = decode_packed(dense[8][0], signed=True, delta=True)
+    lons = decode_packed(dense[9][0], signed=True, delta=True)
+    keys_vals = decode_packed(dense[10][0]) if 10 in dense else []
+    infos = [{} for i in ids]
+    if 5 in dense:
+        info = decode_message(dense[5][0])
+        columns = [
+            ("version", str, decode_packed(info[1][0]) if 1 in info else []),
+            (
+                "timestamp",
+                lambda t: to_timestamp(t, date_granularity),
+                decode_packed(info[2][0], True, True) if 2 in info else [],
+            ),
+            (
+                "changeset",
+                str,
+                decode_packed(info[3][0], True, True) if 3 in info else [],
+            ),
+            ("uid", str, decode_packed(info[4][0], True, True) if 4 in info else []),
+            (
+                "user",
+                lambda s: strings[s],
+                decode_packed(info[5][0], True, True) if 5 in info else [],
+            ),
+        ]
+        for (name, convert, values) in columns:
+            for (attrs, value) in zip(infos, values):
+                if value:
+                    attrs[name] = convert(value)
+    kv = 0
+    for (eid, lat, lon, attrs) in zip(ids, lats, lons, infos):
+        tags = {}
+        while kv < len(keys_vals) and keys_vals[kv] != 0:
+            tags[strings[keys_vals[kv]]] = strings[keys_vals[kv + 1]]
+            kv += 2
+        kv += 1
+        attrs["id"] = eid
+        x = (lon_offset + granularity * lon) / 1e9
+        y = (lat_offset + granularity * lat) / 1e9
+        yield data.Node(x, y, tags=tags, attrs=attrs)
+
+
+def deserialize(infile, data=None):
+    """Generate a OSM data set from a PBF binary file or append to existing data."""
+    if data is None:
+        data = osm.Osm()
+    refs = {"n": {}, "w": {}, "r": {}}  # elements of this file by type and id
+    ways = []
+    relations = []
+    for (blob_type, blob) in read_blobs(infile):
+        if blob_type == "OSMHeader":
+            header = decode_message(blob)
+            if 16 in header:
+                data.generator = bytes(header[16][0]).decode("utf-8")
+            continue
+        if blob_type != "OSMData":
+            continue
+        block = decode_message(blob)
+        strings = [
+            bytes(s).decode("utf-8") for s in decode_message(block[1][0]).get(1, [])
+        ]
+        offsets = (
+            block.get(17, [GRANULARITY])[0],
+            decode_int64(block.get(19, [0])[0]),
+            decode_int64(block.get(20, [0])[0]),
+            block.get(18, [1000])[0],
+        )
+        for group in block.get(2, []):
+            group = decode_message(group)
+            for node in group.get(1, []):
+                fields = decode_message(node)
+                attrs = decode_attrs(fields, strings, offsets[3])
+                attrs["id"] = unzigzag(fields[1][0])
+                x = (offsets[2] + offsets[0] * unzigzag(fields[9][0])) / 1e9
+                y = (offsets[1] + offsets[0] * unzigzag(fields[8][0])) / 1e9
+                n = data.Node(x, y, tags=decode_tags(fields, strings), attrs=attrs)
+                refs["n"][n.id] = n
+            for dense in group.get(2, []):
+                for n in decode_dense(decode_message(dense), strings, offsets, data):
+                    refs["n"][n.id] = n
+            for way in group.get(3, []):
+                fields = decode_message(way)
+                attrs = decode_attrs(fields, strings, offsets[3])
+                attrs["id"] = decode_int64(fields[1][0])
+                w = data.Way(tags=decode_tags(fields, strings), attrs=attrs)
+                if 8 in fields:
+                    w.nodes = decode_packed(fields[8][0], signed=True, delta=True)
+                refs["w"][w.id] = w
+                ways.append(w)
+            for rel in group.get(4, []):
+                fields = decode_message(rel)
+                attrs = decode_attrs(fields, strings, offsets[3])
+                attrs["id"] = decode_int64(fields[1][0])
+                r = data.Relation(tags=decode_tags(fields, strings), attrs=attrs)
+                roles = decode_packed(fields[8][0]) if 8 in fields else []
+                ids = decode_packed(fields[9][0], True, True) if 9 in fields else []
+                types = decode_packed(fields[10][0]) if 10 in fields else []
+                r.members = [
+                    (MEMBER_TYPES[t], ref, strings[role] or None)
+                    for (role, ref, t) in zip(roles, ids, types)
+                ]
+                refs["r"][r.id] = r
+                relations.append(r)
+    resolve_refs(data, refs, ways, relations)
+    return data
@@ -1,18 +1,51 @@
 """OSM XML format serializer."""
+import gzip
+import io
 import logging
+import os
+import re
+from itertools import chain
 
 from lxml import etree
 
-from catatom2osm import config, osm
+from catatom2osm import config, osm, pgzip
 
 log = logging.getLogger(config.app_name)
 
 
+ESCAPE_TABLE = str.maketrans(
+    {
+        "&": "&amp;",
+        "<": "&lt;",
+        ">": "&gt;",
+        '"': "&quot;",
+        "\n": "&#10;",
+        "\r": "&#13;",
+        "\t": "&#9;",
+    }
+)
+INVALID_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f\ud800-\udfff\ufffe\uffff]")
+BUFFER_SIZE = 1000  # elements written at once
+CACHE_SIZE = 100000  # maximum number of cached markup strings
+BODY_START = re.compile(rb"\s*<(node|way|relation|/osm)\b")
+FIXME_TAG = re.compile(rb"""<tag\s+k=["']fixme["']""")
+
+
+def escape(value):
+    """Escape an attribute value in the same way as lxml."""
+    if INVALID_CHARS.search(value):
+        raise ValueError(
+            "All strings must be XML compatible: Unicode or ASCII, "
+            "no NULL bytes or control characters"
+        )
+    value = value.translate(ESCAPE_TABLE)
+    if not value.isascii():
+        value = value.encode("ascii", "xmlcharrefreplace").decode()
+    return value
+
+
 def write_elem(outfile, e):
-    try:
-        outfile.write(etree.tostring(e, pretty_print=True).decode())
-    except TypeError:  # pragma: no cover
-        outfile.write(etree.tostring(e).decode())
+    outfile.write(etree.tostring(e, pretty_print=True).decode())
 
 
 def serialize(outfile, data):
@@ -34,43 +67,104 @@ def serialize(outfile, data):
         for (key, value) in data.tags.items():
             e.append(etree.Element("tag", dict(k=key, v=str(value))))
         write_elem(outfile, e)
-    for node in data.nodes:
-        e = etree.Element("node", node.attrs)
-        for key, value in node.tags.items():
-            e.append(etree.Element("tag", dict(k=key, v=str(value))))
-        write_elem(outfile, e)
-    for way in data.ways:
-        e = etree.Element("way", way.attrs)
-        for node in way.nodes:
-            e.append(etree.Element("nd", dict(ref=str(node.id))))
-        for key, value in way.tags.items():
-            e.append(etree.Element("tag", dict(k=key, v=str(value))))
-        write_elem(outfile, e)
-    for rel in data.relations:
-        e = etree.Element("relation", rel.attrs)
-        for m in rel.members:
-            e.append(etree.Element("member", m.attrs))
-        for key, value in rel.tags.items():
-            e.append(etree.Element("tag", dict(k=key, v=str(value))))
-        write_elem(outfile, e)
+    cache = {}  # markup of repeated attributes and tags
+
+    def attrs(el):
+        values = osm.merge_attrs(el)
+        if values not in cache:
+            cache[values] = "".join(
+                [
+                    ' {}="{}"'.format(k, escape(str(v)))
+                    for (k, v) in zip(osm.Element._attr_list[1:], values)
+                    if v is not None
+                ]
+            )
+        return cache[values]
+
+    def tags(el, lines):
+        if el._tags:
+            for item in el._tags.items():
+                if item not in cache:
+                    cache[item] = '  <tag k="{}" v="{}"/>\n'.format(
+                        escape(item[0]), escape(str(item[1]))
+                    )
+                lines.append(cache[item])
+        return lines
+
+    def write(buffer, start, lines, name):
+        if lines:
+            buffer.append("{}>\n{}</{}>\n".format(start, "".join(lines), name))
+        else:
+            buffer.append(start + "/>\n")
+        if len(buffer) >= BUFFER_SIZE:
+            outfile.write("".join(buffer))
+            buffer.clear()
+            if len(cache) > CACHE_SIZE:
+                cache.clear()
+
+    buffer = []
+    for n in data.nodes:
+        start = '<node id="{}"{} lon="{}" lat="{}"'.format(n.id, attrs(n), n.x, n.y)
+        write(buffer, start, tags(n, []), "node")
+    for w in data.ways:
+        start = '<way id="{}"{}'.format(w.id, attrs(w))
+        lines = ['  <nd ref="{}"/>\n'.format(n.id) for n in w.nodes]
+        write(buffer, start, tags(w, lines), "way")
+    for r in data.relations:
+        start = '<relation id="{}"{}'.format(r.id, attrs(r))
+        lines = []
+        for m in r.members:
+            role = "" if m.role is None else ' role="{}"'.format(escape(m.role))
+            lines.append(
+                '  <member type="{}" ref="{}"{}/>\n'.format(m.type, m.ref, role)
+            )
+        write(buffer, start, tags(r, lines), "relation")
+    outfile.write("".join(buffer))
     outfile.write("</osm>\n")
 
 
-def deserialize(infile, data=None):
-    """Generate a OSM data set from OSM XML or append to existing data."""
+def deserialize(infile, data=None, types=None, query=None, geometry=True):
+    """
+    Generate a OSM data set from OSM XML or append to existing data.
+
+    Elements excluded by types or query are not created, except the nodes of
+    the read ways, that get only their coordinates. Data read with filters is
+    not meant to be uploaded: ways and relations with excluded children
+    increase their version.
+
+    Args:
+        infile: file object to read from
+        data (Osm): data set to append to
+        types (iterable): types of elements to read ('node', 'way' or
+            'relation'), all by default
+        query (func): function that takes the tags of an element and returns
+            True if it must be read
+        geometry (bool): if False, ways and relations are read without nodes
+            nor members
+    """
     if data is None:
         data = osm.Osm()
-    context = etree.iterparse(infile, events=("end",))
-    childs = []
-    tags = {}
+    types = ("node", "way", "relation") if types is None else tuple(types)
+    refs = {"n": {}, "w": {}, "r": {}}  # elements of this file by type and id
+    coords = None  # coordinates of excluded nodes by id
+    if geometry and "way" in types and ("node" not in types or query):
+        coords = {}
+    ways = []
+    relations = []
+    elem_tags = ("osm", "changeset", "note", "meta") + types
+    if coords is not None and "node" not in types:
+        elem_tags += ("node",)
+    context = etree.iterparse(infile, events=("end",), tag=elem_tags)
     for event, elem in context:
         if elem.tag == "osm":
             data.upload = elem.get("upload")
             data.version = elem.get("version")
             data.generator = elem.get("generator")
-        elif elem.tag == "changeset":
+            continue
+        tags = {t.get("k"): t.get("v") for t in elem.iterchildren("tag")}
+        skip = elem.tag in types and query is not None and not query(tags)
+        if elem.tag == "changeset":
             data.tags = tags
-            tags = {}
         elif elem.tag == "note":
             data.note = str(elem.text)
         elif elem.tag == "meta":
@@ -78,64 +172,125 @@ def deserialize(infile, data=None):
         elif elem.tag == "node":
             lon = float(elem.get("lon"))
             lat = float(elem.get("lat"))
-            n = data.Node(lon, lat, tags=tags, attrs=dict(elem.attrib))
-            tags = {}
-        elif elem.tag == "way":
+            if skip or elem.tag not in types:
+                if coords is not None:
+                    coords[int(elem.get("id"))] = (lon, lat)
+            else:
+                n = data.Node(lon, lat, tags=tags, attrs=dict(elem.attrib))
+                refs["n"][n.id] = n
+        elif elem.tag == "way" and not skip:
             w = data.Way(tags=tags, attrs=dict(elem.attrib))
-            w.nodes = childs
-            childs = []
-            tags = {}
-        elif elem.tag == "nd":
-            childs.append(elem.get("ref"))
-        elif elem.tag == "relation":
+            if geometry:
+                w.nodes = [int(nd.get("ref")) for nd in elem.iterchildren("nd")]
+                ways.append(w)
+            refs["w"][w.id] = w
+        elif elem.tag == "relation" and not skip:
             r = data.Relation(tags=tags, attrs=dict(elem.attrib))
-            r.members = childs
-            childs = []
-            tags = {}
-        elif elem.tag == "member":
-            childs.append(
-                {
-                    "ref": elem.get("ref"),
-                    "type": elem.get("type"),
-                    "role": elem.get("role"),
-                }
-            )
-        elif elem.tag == "tag":
-            tags[elem.get("k")] = elem.get("v")
+            if geometry:
+                r.members = [
+                    (m.get("type"), int(m.get("ref")), m.get("role"))
+                    for m in elem.iterchildren("member")
+                ]
+                relations.append(r)
+            refs["r"][r.id] = r
         elem.clear()
-        if hasattr(elem, "xpath"):
-            for ancestor in elem.xpath("ancestor-or-self::*"):
-                while ancestor.getprevious() is not None:
-                    del ancestor.getparent()[0]
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
     del context
-    for way in data.ways:
-        missing = []
-        for i, ref in enumerate(way.nodes):
-            if isinstance(ref, str):
-                if "n{}".format(ref) in data.index:
-                    n = data.get(ref)
-                    way.nodes[i] = n
-                    data.parents[n].add(way)
-                else:
-                    missing.append(i)
-        if len(missing) > 0:
-            for i in sorted(missing, reverse=True):
-                way.nodes.pop(i)
-            if way.version is not None:
-                way.version = str(int(way.version) + 1)
-    for rel in data.relations:
-        missing = []
-        for i, m in enumerate(rel.members):
-            if isinstance(m, dict):
-                if m["type"][0].lower() + str(m["ref"]) in data.index:
-                    el = data.get(m["ref"], m["type"])
-                    rel.members[i] = osm.Relation.Member(el, m["role"])
-                    data.parents[el].add(rel)
-                else:
-                    missing.append(i)
-        if len(missing) > 0:
-            for i in sorted(missing, reverse=True):
-                rel.members.pop(i)
-            if rel.version is not None:
-                rel.version = str(int(rel.version) + 1)
+    resolve_refs(data, refs, ways, relations, coords)
     return data
+
+
+def resolve_refs(data, refs, ways, relations, coords=None):
+    """
+    Replace the ids of way nodes and relation members with elements.
+
+    The elements are searched first in refs, a dictionary of elements by id
+    for each type ('n', 'w', 'r') and then in the index of data. Nodes not
+    found are created from coords, a dictionary of coordinates by id, if
+    present. Missing elements are removed and the version of their parents
+    is increased.
+    """
+
+    def get(etype, ref):
+        el = refs.get(etype, {}).get(ref)
+        if el is None:
+            el = data.index.get(etype + str(ref))
+        if el is None and etype == "n" and coords and ref in coords:
+            el = data.Node(*coords.pop(ref), attrs={"id": ref})
+            refs["n"][ref] = el
+        return el
+
+    for way in ways:
+        nodes = [n for n in (get("n", ref) for ref in way.nodes) if n is not None]
+        if len(nodes) < len(way.nodes) and way.version is not None:
+            way.version = str(int(way.version) + 1)
+        way.nodes = nodes
+        for n in nodes:
+            data.parents[n].add(way)
+    for rel in relations:
+        members = []
+        for (etype, ref, role) in rel.members:
+            el = get(etype[0].lower(), ref)
+            if el is not None:
+                members.append(osm.Relation.Member(el, role))
+                data.parents[el].add(rel)
+        if len(members) < len(rel.members) and rel.version is not None:
+            rel.version = str(int(rel.version) + 1)
+        rel.members = members
+
+
+def update_changeset(path, tags):
+    """
+    Update the changeset tags of an OSM XML file without parsing its elements.
+
+    Only the header is regenerated, the elements are copied unchanged and the
+    file is not rewritten if the tags don't change.
+
+    Args:
+        path (str): OSM XML file name (compressed if ends with .gz)
+        tags (dict): changeset tags to add or replace
+
+    Returns:
+        (int) Number of fixme tags in the file elements
+    """
+    compressed = path.endswith(".gz")
+    infile = gzip.open(path, "rb") if compressed else open(path, "rb")
+    with infile:
+        header = []
+        first = []  # first line of the elements
+        for line in infile:
+            if BODY_START.match(line):
+                first.append(line)
+                break
+            header.append(line)
+        if first:
+            header.append(b"</osm>")  # Close the root element to parse the header
+        data = deserialize(io.BytesIO(b"".join(header)))
+        oldtags = dict(data.tags)
+        data.tags.update(tags)
+        body = chain(first, infile)
+        if data.tags == oldtags:
+            return sum(len(FIXME_TAG.findall(line)) for line in body)
+        fixmes = 0
+        tmp_path = path + ".tmp"
+        if compressed:
+            outfile = pgzip.GzipWriter(tmp_path, threads=1)
+        else:
+            outfile = open(tmp_path, "wb")
+        try:
+            with outfile:
+                text = io.StringIO()
+                serialize(text, data)
+                text = text.getvalue()
+                if first:
+                    text = text[: -len("</osm>\n")]
+                outfile.write(text.encode())
+                for line in body:
+                    fixmes += len(FIXME_TAG.findall(line))
+                    outfile.write(line)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+    return fixmes
@@ -0,0 +1,120 @@
+"""Parallel gzip writer.
+
+Data is split in independent blocks compressed in a thread pool (zlib releases
+the GIL) and written in order as members of a standard multi-member gzip
+stream, readable by any gzip decompressor. The thread pools are shared by all
+the writers of a process.
+"""
+import gzip
+import io
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from catatom2osm import config
+
+BLOCK_SIZE = 1 << 20  # Uncompressed bytes per gzip member
+
+executors = {}  # Thread pools by process id and number of threads
+
+
+def compress_block(data, level):
+    """Compress a block as a complete gzip member."""
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def get_executor(threads):
+    """Return the thread pool of this process with the number of threads."""
+    key = (os.getpid(), threads)
+    executor = executors.get(key)
+    if executor is None:
+        executor = ThreadPoolExecutor(max_workers=threads)
+        executors[key] = executor
+    return executor
+
+
+class GzipWriter(io.RawIOBase):
+    """Binary file object that compresses blocks in parallel."""
+
+    def __init__(self, filename, level=None, threads=None, block_size=BLOCK_SIZE):
+        """
+        Open filename for writing.
+
+        Args:
+            filename (str or file object): output file
+            level (int): compression level, config.compresslevel by default
+            threads (int): number of threads, config.compress_threads by
+                default, or the number of CPUs if it is 0
+            block_size (int): uncompressed size of each gzip member
+        """
+        super().__init__()
+        self.level = config.compresslevel if level is None else level
+        threads = config.compress_threads if threads is None else threads
+        self.threads = threads or os.cpu_count() or 1
+        if isinstance(filename, (str, bytes, os.PathLike)):
+            self.fileobj = open(filename, "wb")
+            self.own_file = True
+        else:
+            self.fileobj = filename
+            self.own_file = False
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.pending = deque()
+        self.members = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        """Buffer data and compress each completed block."""
+        if self.closed:
+            raise ValueError("write to closed file")
+        self.buffer += data
+        size = self.block_size
+        end = len(self.buffer) - len(self.buffer) % size
+        for i in range(0, end, size):
+            self.submit(bytes(self.buffer[i : i + size]))
+        del self.buffer[:end]
+        return len(data)
+
+    def submit(self, block):
+        """Queue a block, writing completed members in order."""
+        self.members += 1
+        if self.threads == 1:
+            self.fileobj.write(compress_block(block, self.level))
+            return
+        executor = get_executor(self.threads)
+        self.pending.append(executor.submit(compress_block, block, self.level))
+        while len(self.pending) > 2 * self.threads:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def flush(self):
+        """Write the members already compressed, the last block stays buffered."""
+        while self.pending and self.pending[0].done():
+            self.fileobj.write(self.pending.popleft().result())
+        self.fileobj.flush()
+
+    def close(self):
+        """
+        Compress the buffered data and write all pending members.
+
+        The last block is compressed in this thread, so a file smaller than
+        a block doesn't use the thread pool.
+        """
+        if self.closed:
+            return
+        try:
+            last = None
+            if self.buffer or not self.members:
+                self.members += 1
+                last = compress_block(bytes(self.buffer), self.level)
+                self.buffer.clear()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+            if last is not None:
+                self.fileobj.write(last)
+            self.fileobj.flush()
+        finally:
+            super().close()
+            if self.own_file:
+                self.fileobj.close()
@@ -1,10 +1,14 @@
 """Statistics report."""
+import functools
 import io
 import json
 import locale
 import platform
+import sys
+import threading
 import time
 from collections import Counter, OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
 
 import psutil
@@ -15,8 +19,88 @@ TAB = "  "
 SEP = ": "
 MEMORY_UNIT = 1048576.0
 MEMORY_LABEL = "MB"
+MAX_SAMPLES = 1000  # Memory samples kept, halved doubling the interval when full
+PROFILE_KEYS = (  # Profiling values, never loaded from a file
+    "peak_rss",
+    "peak_stage",
+    "memory_samples",
+    "timeline",
+    "profile_stages",
+)
+RUN_KEYS = (  # Values of the current run, kept when resuming from a file
+    "mun_code",
+    "date",
+    "options",
+    "app_version",
+    "platform",
+    "language",
+    "qgs_version",
+    "gdal_version",
+    "cpu_count",
+    "cpu_freq",
+    "memory",
+    "rss",
+    "vms",
+)
 int_format = lambda v: locale.format_string("%d", v, True)
 
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def get_peak_rss():
+    """Return the peak physical memory usage of the process in bytes."""
+    if resource is None:
+        return getattr(psutil.Process().memory_info(), "peak_wset", 0)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def get_feature_counts(obj):
+    """Return the feature count of a layer or of the layers attributes of obj."""
+    if hasattr(obj, "featureCount"):
+        return {obj.name(): obj.featureCount()}
+    return {
+        k: v.featureCount()
+        for (k, v) in vars(obj).items()
+        if hasattr(v, "featureCount")
+    }
+
+
+class MemorySampler(threading.Thread):
+    """Thread that samples the physical memory of the process at intervals."""
+
+    def __init__(self, report, interval):
+        super().__init__(daemon=True)
+        self.report = report
+        self.interval = interval
+        self.samples = []  # seconds from the report start and RSS in MB
+        self.peak = 0
+        self.peak_stage = None
+        self.stopped = threading.Event()
+
+    def run(self):
+        process = psutil.Process()
+        while True:
+            rss = process.memory_info().rss / MEMORY_UNIT
+            elapsed = time.time() - self.report.start_time
+            self.samples.append((round(elapsed, 3), round(rss, 2)))
+            if rss > self.peak:
+                self.peak = rss
+                stages = self.report.active_stages[:]
+                self.peak_stage = "/".join(e["name"] for e in stages) or None
+            if len(self.samples) >= MAX_SAMPLES:
+                del self.samples[1::2]
+                self.interval *= 2
+            if self.stopped.wait(self.interval):
+                break
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
 
 class Report(object):
     def __init__(self, **kwargs):
@@ -45,6 +129,12 @@ class Report(object):
                 ("memory", _("Total memory")),
                 ("rss", _("Physical memory usage")),
                 ("vms", _("Virtual memory usage")),
+                ("peak_rss", _("Peak physical memory usage")),
+                ("peak_stage", TAB + _("Stage")),
+                ("memory_samples", None),
+                ("timeline", None),
+                ("group_profile", _("Profile")),
+                ("profile_stages", ""),
                 ("group_address", _("Addresses")),
                 ("subgroup_ad_cdau", "CDAU"),
                 ("inp_address_cdau", _("Feature count")),
@@ -151,10 +241,13 @@ class Report(object):
             "memory": lambda v: locale.format_string("%.2f ", v, True) + MEMORY_LABEL,
             "rss": lambda v: locale.format_string("%.2f ", v, True) + MEMORY_LABEL,
             "vms": lambda v: locale.format_string("%.2f ", v, True) + MEMORY_LABEL,
+            "peak_rss": lambda v: locale.format_string("%.2f ", v, True) + MEMORY_LABEL,
         }
+        self.sampler = None
         self.clear(**kwargs)
 
     def clear(self, **kwargs):
+        self.stop_sampler()
         self.start_time = time.time()
         self.values = {
             "date": datetime.now().strftime("%x"),
@@ -167,6 +260,8 @@ class Report(object):
         }
         self.get_sys_info()
         self.tasks_with_fixmes = Counter()
+        self.stages = []  # profile of each stage in start order
+        self.active_stages = []
         for k, v in list(kwargs.items()):
             self.values[k] = v
 
@@ -212,6 +307,26 @@ class Report(object):
                 if task_label is not None:
                     self.tasks_with_fixmes[task_label] += 1
 
+    def clear_stats(self):
+        """Start the values counted by the statistics of a task."""
+        self.values = {
+            "warnings": [],
+            "fixme_counter": Counter(),
+            "building_counter": Counter(),
+        }
+        self.tasks_with_fixmes = Counter()
+
+    def add_stats(self, values, tasks_with_fixmes):
+        """Add the values counted by the statistics of a task in other process."""
+        for (key, value) in values.items():
+            if isinstance(value, Counter):
+                self.values.setdefault(key, Counter()).update(value)
+            elif isinstance(value, list):
+                self.values.setdefault(key, []).extend(value)
+            else:
+                self.inc(key, value)
+        self.tasks_with_fixmes.update(tasks_with_fixmes)
+
     def get_tasks_with_fixmes(self):
         fixmes = self.tasks_with_fixmes
         return {k: fixmes[k] for k in sorted(fixmes.keys())}
@@ -251,6 +366,116 @@ class Report(object):
             ]
         return fixme_count
 
+    @contextmanager
+    def stage(self, name, obj=None):
+        """
+        Record wall and CPU time, peak memory increase and features of a stage.
+
+        Stages can be nested. The CPU time doesn't include child processes.
+
+        Args:
+            name (str): stage name
+            obj: layer or object with layers to count their features at end
+        """
+        entry = {
+            "name": name,
+            "level": len(self.active_stages),
+            "start": round(time.time() - self.start_time, 3),
+        }
+        self.stages.append(entry)
+        self.active_stages.append(entry)
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        peak = get_peak_rss()
+        try:
+            yield entry
+        finally:
+            self.active_stages.pop()
+            entry["wall"] = round(time.perf_counter() - wall, 3)
+            entry["cpu"] = round(time.process_time() - cpu, 3)
+            entry["peak_rss"] = round((get_peak_rss() - peak) / MEMORY_UNIT, 2)
+            if obj is not None:
+                entry["features"] = get_feature_counts(obj)
+
+    def profile(self, func):
+        """Decorate a layer method to record it as a stage."""
+
+        @functools.wraps(func)
+        def wrapper(layer, *args, **kwargs):
+            with self.stage(layer.name() + "." + func.__name__, layer):
+                return func(layer, *args, **kwargs)
+
+        return wrapper
+
+    def start_sampler(self, interval=None):
+        """Sample the memory in a background thread, see MemorySampler."""
+        self.stop_sampler()
+        interval = config.memory_interval if interval is None else interval
+        self.sampler = MemorySampler(self, interval)
+        self.sampler.start()
+
+    def stop_sampler(self):
+        """Stop the memory sampler and put its results in the report values."""
+        if self.sampler is None:
+            return
+        self.sampler.stop()
+        self.peak_rss = self.sampler.peak
+        if self.sampler.peak_stage is not None:
+            self.peak_stage = self.sampler.peak_stage
+        self.memory_samples = self.sampler.samples
+        self.sampler = None
+
+    def clear_sampler(self):
+        """Stop the memory sampler and remove its results from the values."""
+        self.stop_sampler()
+        for k in ("peak_rss", "peak_stage", "memory_samples"):
+            self.values.pop(k, None)
+
+    def profile_stats(self):
+        """Put the stages profile and memory samples in the report values."""
+        self.stop_sampler()
+        self.timeline = self.stages
+        self.profile_stages = []
+        for entry in self.stages:
+            if "wall" not in entry:
+                continue
+            line = TAB * entry["level"] + entry["name"] + SEP
+            line += locale.format_string(
+                "%.1f s, CPU %.1f s", (entry["wall"], entry["cpu"]), True
+            )
+            line += (
+                locale.format_string(", +%.1f ", entry["peak_rss"], True) + MEMORY_LABEL
+            )
+            features = entry.get("features", {})
+            line += "".join(
+                ", %s %s" % (k, int_format(v)) for (k, v) in features.items()
+            )
+            self.profile_stages.append(line)
+
+    def export_timeline(self, fn):
+        """Write the stages profile in the Trace Event Format (chrome://tracing)."""
+        events = [
+            {
+                "name": entry["name"],
+                "ph": "X",
+                "ts": int(entry["start"] * 1e6),
+                "dur": int(entry["wall"] * 1e6),
+                "pid": 0,
+                "tid": 0,
+                "args": {
+                    k: entry[k] for k in ("cpu", "peak_rss", "features") if k in entry
+                },
+            }
+            for entry in self.stages
+            if "wall" in entry
+        ]
+        events += [
+            {"name": "rss", "ph": "C", "ts": int(t * 1e6), "pid": 0, "args": {"MB": v}}
+            for (t, v) in self.get("memory_samples", [])
+        ]
+        with open(fn, "w") as fo:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fo)
+
     def get(self, key, default=0):
         return self.values.get(key, default)
 
@@ -426,12 +651,23 @@ class Report(object):
         with open(fn, "w") as fo:
             fo.write(json.dumps(self.values))
 
-    def from_file(self, fn):
+    def from_file(self, fn, keep=()):
+        """
+        Load the values exported to fn.
+
+        The profiling values and the ones in keep retain their current value.
+        """
+        current = self.values
         with open(fn, "r") as fo:
             self.values = json.loads(fo.read())
             for k, v in self.values.items():
                 if k.endswith("_counter"):
                     self.values[k] = Counter(v)
+        for k in PROFILE_KEYS + tuple(keep):
+            if k in current:
+                self.values[k] = current[k]
+            else:
+                self.values.pop(k, None)
 
 
 instance = Report()
@@ -256,3 +256,13 @@ class TestBaseLayer2(unittest.TestCase):
         mock_os.remove.assert_called_once_with("foobar")
         layer.export("foobar", "foo", overwrite=False)
         mock_os.remove.assert_called_once_with("foobar")
+
+    @mock.patch("catatom2osm.geo.layer.base.QgsVectorFileWriter", mock.MagicMock())
+    @mock.patch("catatom2osm.geo.layer.base.BaseLayer.writeAsVectorFormat")
+    @mock.patch("catatom2osm.geo.layer.base.os")
+    def test_export_layer_name(self, mock_os, mock_wvf):
+        layer = BaseLayer("Polygon", "test", "memory")
+        mock_os.path.exists.return_value = True
+        layer.export("foobar.gpkg", "GPKG", layer_name="foo")
+        mock_os.remove.assert_not_called()
+        mock_wvf.assert_called_once_with("foobar.gpkg", "GPKG", layer.crs(), "foo")
@@ -504,6 +504,15 @@ class TestConsLayer(unittest.TestCase):
         self.assertEqual(ways, len(data.ways))
         self.assertEqual(rels, len(data.relations))
 
+    def test_to_osm_fids(self):
+        fids = [feat.id() for feat in self.layer.getFeatures()][:3]
+        data = self.layer.to_osm(fids=fids)
+        request = QgsFeatureRequest().setFilterFids(fids)
+        ways = 0
+        for feat in self.layer.getFeatures(request):
+            ways += sum([len(s) for s in Geometry.get_multipolygon(feat)])
+        self.assertEqual(ways, len(data.ways))
+
     @mock.patch("catatom2osm.geo.layer.base.log", m_log)
     @mock.patch("catatom2osm.geo.layer.cons.log", m_log)
     @mock.patch("catatom2osm.geo.layer.base.progressbar", mock.MagicMock())
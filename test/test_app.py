@@ -1,20 +1,45 @@
+import functools
+import gzip
+import json
 import logging
 import os
+import tempfile
 import unittest
+from concurrent.futures import ThreadPoolExecutor
 from importlib import reload
 from optparse import Values
 
 import mock
 from qgis.core import QgsVectorLayer
 
-from catatom2osm import app, config, osm
-from catatom2osm.exceptions import CatIOError
+from catatom2osm import app, config, geo, osm
+from catatom2osm.exceptions import CatConfigError, CatIOError, CatValueError
 
 qgs = app.QgsSingleton()
 os.environ["LANGUAGE"] = "C"
 config.install_gettext("catato2osm", "")
 m_log = mock.MagicMock()
 m_log.app_level = logging.INFO
+OVERPASS_XML = """<osm version="0.6">
+<node id="1" lat="40.1" lon="-3.1"/>
+<node id="2" lat="40.2" lon="-3.1"/>
+<way id="3"><nd ref="1"/><nd ref="2"/>
+<tag k="highway" v="residential"/><tag k="name" v="Calle Mayor"/></way>
+</osm>"""
+OVERPASS_JSON = json.dumps(
+    {
+        "elements": [
+            {"type": "node", "id": 1, "lat": 40.1, "lon": -3.1},
+            {"type": "node", "id": 2, "lat": 40.2, "lon": -3.1},
+            {
+                "type": "way",
+                "id": 3,
+                "nodes": [1, 2],
+                "tags": {"highway": "residential", "name": "Calle Mayor"},
+            },
+        ]
+    }
+)
 
 
 def get_func(f):
@@ -55,6 +80,9 @@ class TestCatAtom2Osm(unittest.TestCase):
             "task": ["33333"],
             "comment": False,
             "split": None,
+            "jobs": 1,
+            "checkpoint": False,
+            "sample_memory": False,
             "args": "33333",
         }
         self.m_app = mock.MagicMock()
@@ -65,6 +93,10 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.zone = self.m_app.options.zone
         self.m_app.tasks_path = "33333/tasks"
         self.m_app.is_new = False
+        self.m_app.checkpoint = None
+        self.m_app.run_stages = lambda *stages: get_func(app.CatAtom2Osm.run_stages)(
+            self.m_app, *stages
+        )
         self.m_app.cat.get_path = lambda *args: self.m_app.path + "/" + "/".join(args)
 
     @mock.patch("catatom2osm.app.report", mock.MagicMock())
@@ -88,8 +120,8 @@ class TestCatAtom2Osm(unittest.TestCase):
         reload(app)
         m_gdal.PushErrorHandler.called_once_with("CPLQuietErrorHandler")
 
-    @mock.patch("catatom2osm.app.report", mock.MagicMock())
-    def test_run_default(self):
+    @mock.patch("catatom2osm.app.report")
+    def test_run_default(self, m_report):
         self.m_app.source = "building"
         self.m_app.building = mock.MagicMock()
         self.m_app.is_new = True
@@ -97,6 +129,8 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.run = get_func(app.CatAtom2Osm.run)
         self.m_app.run(self.m_app)
         self.m_app.stop_address.assert_called_once_with()
+        m_report.clear_sampler.assert_called_once_with()
+        m_report.start_sampler.assert_not_called()
 
     @mock.patch("catatom2osm.app.report", mock.MagicMock())
     def test_run_default_2nd(self):
@@ -108,6 +142,96 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.resume_address.assert_called_once_with()
         self.m_app.process_tasks.assert_called_once_with(self.m_app.building)
 
+    @mock.patch("catatom2osm.app.log", m_log)
+    @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    def test_run_zoning(self):
+        self.m_app.is_new = True
+        self.m_app.options.address = False
+        self.m_app.options.zoning = True
+        self.m_app.run = get_func(app.CatAtom2Osm.run)
+        self.m_app.run(self.m_app)
+        names = [c[0] for c in self.m_app.mock_calls if c[0].count(".") == 0]
+        stages = [
+            "get_parcel",
+            "get_building",
+            "get_zoning",
+            "export_poly",
+            "process_building",
+            "process_parcel",
+        ]
+        self.assertEqual([n for n in names if n in stages], stages)
+
+    def test_get_checkpoint(self):
+        self.m_app.options.checkpoint = True
+        self.m_app.options.parcel = []
+        self.m_app.split = None
+        self.m_app.get_checkpoint = get_func(app.CatAtom2Osm.get_checkpoint)
+        with tempfile.TemporaryDirectory() as path:
+            self.m_app.aux_path = os.path.join(path, "aux")
+            self.m_app.highway_names_path = os.path.join(path, "highway_names.csv")
+            self.m_app.cat.get_path = lambda *args: os.path.join(path, *args)
+            keys = []
+            for content in ("foo", "bar"):
+                for fn in ("current_address.osm", "current_highway.osm"):
+                    with open(os.path.join(path, fn), "w") as fo:
+                        fo.write(content + fn)
+                    keys.append(self.m_app.get_checkpoint(self.m_app).keys)
+        for (k1, k2) in zip(keys, keys[1:]):
+            self.assertEqual(k1["get_address"], k2["get_address"])
+            self.assertNotEqual(k1["process_address"], k2["process_address"])
+
+    @mock.patch("catatom2osm.app.log", m_log)
+    def test_run_stages(self):
+        self.m_app.run_stages("foo", "bar")
+        self.m_app.foo.assert_called_once_with()
+        self.m_app.bar.assert_called_once_with()
+        self.m_app.load_checkpoint.assert_not_called()
+        self.m_app.save_checkpoint.assert_not_called()
+
+    @mock.patch("catatom2osm.app.log", m_log)
+    def test_run_stages_checkpoint(self):
+        self.m_app.checkpoint = mock.MagicMock()
+        self.m_app.checkpoint.keys = {"foo": "1", "bar": "2", "taz": "3"}
+        self.m_app.checkpoint.last_valid.return_value = "bar"
+        self.m_app.run_stages("foo", "bar", "taz", "xyz")
+        self.m_app.load_checkpoint.assert_called_once_with("bar")
+        self.m_app.foo.assert_not_called()
+        self.m_app.bar.assert_not_called()
+        self.m_app.taz.assert_called_once_with()
+        self.m_app.xyz.assert_called_once_with()
+        self.m_app.save_checkpoint.assert_called_once_with("taz")
+
+    @mock.patch("catatom2osm.app.report")
+    @mock.patch("catatom2osm.app.geo")
+    @mock.patch("catatom2osm.app.os")
+    def test_load_checkpoint(self, m_os, m_geo, m_report):
+        self.m_app.checkpoint = mock.MagicMock()
+        self.m_app.checkpoint.load.return_value = {
+            "tasks": None,
+            "boundary_bbox": None,
+            "source_date": {"parcel": "1", "building": "2", "urban_zoning": "3"},
+        }
+        self.m_app.cat.zip_code = "12345"
+        self.m_app.copy_to_memory.return_value = "/vsimem/foo"
+        self.m_app.split = None
+        m_os.path.exists.return_value = False
+        self.m_app.load_checkpoint = get_func(app.CatAtom2Osm.load_checkpoint)
+        self.m_app.load_checkpoint(self.m_app, "bar")
+        m_report.from_file.assert_called_once_with(
+            m_os.path.join.return_value, keep=app.RUN_KEYS
+        )
+        m_geo.ParcelLayer.assert_called_once_with(
+            "12345", "/vsimem/foo|layername=parcel", providerLib="ogr"
+        )
+        m_geo.ConsLayer.assert_called_once_with(
+            "/vsimem/foo|layername=building", providerLib="ogr"
+        )
+        m_geo.ZoningLayer.assert_called_once_with(
+            "/vsimem/foo|layername=urban_zoning", "urbanzoning", "ogr"
+        )
+        self.assertEqual(self.m_app.parcel, m_geo.ParcelLayer.return_value)
+        self.assertEqual(self.m_app.building.source_date, "2")
+
     @mock.patch("catatom2osm.app.log", m_log)
     @mock.patch("catatom2osm.app.geo", mock.MagicMock())
     @mock.patch("catatom2osm.app.report")
@@ -132,15 +256,16 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.building.move_address.assert_not_called()
 
     @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    @mock.patch("catatom2osm.app.merge_address")
     @mock.patch("catatom2osm.app.os")
-    def test_process_tasks(self, m_os):
+    def test_process_tasks(self, m_os, m_merge):
         m_os.path.exists.return_value = True
         self.m_app.get_tasks.return_value = {
-            "123456A": mock.MagicMock(),
-            "123456B": mock.MagicMock(),
-            "123456C": mock.MagicMock(),
-            "123456D": mock.MagicMock(),
-            "123456E": mock.MagicMock(),
+            "123456A": [1],
+            "123456B": [2],
+            "123456C": [3, 4],
+            "123456D": [5],
+            "123456E": [6],
         }
         building = mock.MagicMock()
         building.source_date = 1234
@@ -154,30 +279,286 @@ class TestCatAtom2Osm(unittest.TestCase):
         self.m_app.get_task_comment = lambda x: "X" + x
         self.m_app.process_tasks = get_func(app.CatAtom2Osm.process_tasks)
         self.m_app.process_tasks(self.m_app, building)
-        for label, task in self.m_app.get_tasks.return_value.items():
-            task.to_osm.assert_called_with(upload="yes", tags={"comment": "X" + label})
-        self.assertEqual(self.m_app.merge_address.call_count, 5)
+        for label, fids in self.m_app.get_tasks.return_value.items():
+            building.to_osm.assert_any_call(
+                upload="yes", tags={"comment": "X" + label}, fids=fids
+            )
+        self.assertEqual(m_merge.call_count, 5)
+        self.assertEqual(self.m_app.write_osm.call_count, 5)
+        self.m_app.get_task_executor.assert_not_called()
+
+    @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    @mock.patch("catatom2osm.app.merge_address", mock.MagicMock())
+    @mock.patch("catatom2osm.app.glob")
+    @mock.patch("catatom2osm.app.os")
+    def test_process_tasks_split(self, m_os, m_glob):
+        m_os.path.exists = lambda path: path.endswith(".osm.gz")
+        m_glob.return_value = ["33333/tasks/123456A.osm.gz"]
+        self.m_app.bkp_path = "33333/tasks.bkp"
+        self.m_app.get_tasks.return_value = {"123456A": [1]}
+        pa = mock.MagicMock()
+        values = {"localId": "123456A", "zone": "001"}
+        pa.__getitem__.side_effect = values.__getitem__
+        pa.__setitem__.side_effect = values.__setitem__
+        pa.id.return_value = 7
+        pa.fieldNameIndex.return_value = 2
+        self.m_app.parcel.getFeatures.return_value = [pa]
+        self.m_app.get_task_comment = lambda x: "X" + x
+        self.m_app.process_tasks = get_func(app.CatAtom2Osm.process_tasks)
+        self.m_app.process_tasks(self.m_app, mock.MagicMock())
+        pa.fieldNameIndex.assert_called_once_with("localId")
+        self.m_app.parcel.writer.changeAttributeValues.assert_called_once_with(
+            {7: {2: "123456A-1"}}
+        )
+        self.m_app.write_osm.assert_called_once_with(
+            mock.ANY, "tasks", "123456A-1.osm.gz"
+        )
+
+    @mock.patch("catatom2osm.app.report")
+    @mock.patch("catatom2osm.app.get_address_index")
+    @mock.patch("catatom2osm.app.os")
+    def test_process_tasks_jobs(self, m_os, m_index, m_report):
+        m_os.path.exists.return_value = True
+        self.m_app.options.jobs = 2
+        self.m_app.get_tasks.return_value = {"123456A": [1], "123456B": [2]}
+        self.m_app.parcel.getFeatures.return_value = [
+            {"localId": "123456A", "zone": "001"},
+            {"localId": "123456B", "zone": "00001"},
+        ]
+        self.m_app.split = None
+        self.m_app.get_task_comment = lambda x: "X" + x
+        building = mock.MagicMock()
+        source = mock.MagicMock()
+        executor = mock.MagicMock()
+        future = executor.submit.return_value
+        future.result.return_value = ((1, 2, 3), {"nodes": 1}, {"123456A": 1})
+        listener = mock.MagicMock()
+        self.m_app.get_task_executor.return_value = (source, executor, listener)
+        self.m_app.add_task_result = lambda *args: get_func(
+            app.CatAtom2Osm.add_task_result
+        )(self.m_app, *args)
+        self.m_app.process_tasks = get_func(app.CatAtom2Osm.process_tasks)
+        self.m_app.process_tasks(self.m_app, building)
+        self.m_app.get_task_executor.assert_called_once_with(building)
+        self.m_app.get_tasks.assert_called_once_with(source)
+        executor.submit.assert_has_calls(
+            [
+                mock.call(
+                    app.write_task_job,
+                    "123456A",
+                    [1],
+                    "X123456A",
+                    "33333/tasks/123456A.osm.gz",
+                ),
+                mock.call(
+                    app.write_task_job,
+                    "123456B",
+                    [2],
+                    "X123456B",
+                    "33333/tasks/123456B.osm.gz",
+                ),
+            ],
+            any_order=True,
+        )
+        building.to_osm.assert_not_called()
+        self.m_app.write_osm.assert_not_called()
+        self.assertEqual(m_report.add_stats.call_count, 2)
+        m_report.add_stats.assert_called_with({"nodes": 1}, {"123456A": 1})
+        self.m_app.log_osm_file.assert_called_with(
+            "33333/tasks/123456B.osm.gz", (1, 2, 3)
+        )
+        executor.shutdown.assert_called_once_with()
+        listener.stop.assert_called_once_with()
+        m_index.assert_not_called()
+        m_os.remove.assert_has_calls(
+            [
+                mock.call("33333/" + app.task_source_file),
+                mock.call("33333/" + app.task_address_file),
+            ]
+        )
+
+    @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    @mock.patch("catatom2osm.app.os")
+    def test_process_tasks_jobs_error(self, m_os):
+        m_os.path.exists.return_value = False
+        self.m_app.options.jobs = 2
+        self.m_app.get_tasks.return_value = {"123456A": [1]}
+        self.m_app.parcel.getFeatures.return_value = [
+            {"localId": "123456A", "zone": "001"},
+        ]
+        executor = mock.MagicMock()
+        executor.submit.return_value.result.side_effect = ValueError
+        listener = mock.MagicMock()
+        self.m_app.get_task_executor.return_value = (
+            mock.MagicMock(),
+            executor,
+            listener,
+        )
+        self.m_app.add_task_result = lambda *args: get_func(
+            app.CatAtom2Osm.add_task_result
+        )(self.m_app, *args)
+        self.m_app.process_tasks = get_func(app.CatAtom2Osm.process_tasks)
+        with self.assertRaises(ValueError):
+            self.m_app.process_tasks(self.m_app, mock.MagicMock())
+        executor.shutdown.assert_called_once_with()
+        listener.stop.assert_called_once_with()
+
+    @mock.patch("catatom2osm.app.log", m_log)
+    @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    @mock.patch("catatom2osm.geo.layer.base.log", m_log)
+    @mock.patch("catatom2osm.geo.layer.base.progressbar", mock.MagicMock())
+    def test_process_tasks_jobs_files(self):
+        source = geo.ConsLayer()
+        for fn in ("building.gml", "buildingpart.gml"):
+            fixture = QgsVectorLayer("test/fixtures/" + fn, "building", "ogr")
+            self.assertTrue(fixture.isValid())
+            source.append(fixture)
+        labels = sorted({source.get_id(feat) for feat in source.getFeatures()})
+        self.m_app.parcel.getFeatures.return_value = [
+            {"localId": label, "zone": "001"} for label in labels[:10]
+        ]
+        self.m_app.options.address = False
+        self.m_app.split = None
+        self.m_app.tasks = {}
+        self.m_app.get_task_comment = lambda x: "X" + x
+        for method in ("get_tasks", "get_task_executor", "write_osm"):
+            func = get_func(getattr(app.CatAtom2Osm, method))
+            setattr(self.m_app, method, functools.partial(func, self.m_app))
+        self.m_app.add_task_result = functools.partial(
+            app.CatAtom2Osm.add_task_result, self.m_app
+        )
+        self.m_app.process_tasks = get_func(app.CatAtom2Osm.process_tasks)
+        output = {}
+        for jobs in (1, 2):
+            with tempfile.TemporaryDirectory() as path:
+                self.m_app.cat.get_path = lambda *args: os.path.join(path, *args)
+                self.m_app.tasks_path = os.path.join(path, app.tasks_folder)
+                self.m_app.options.jobs = jobs
+                self.m_app.process_tasks(self.m_app, source)
+                self.assertEqual(os.listdir(path), [app.tasks_folder])
+                output[jobs] = {}
+                for fn in os.listdir(self.m_app.tasks_path):
+                    with gzip.open(os.path.join(self.m_app.tasks_path, fn)) as fo:
+                        output[jobs][fn] = fo.read()
+        self.assertEqual(len(output[1]), len(labels[:10]))
+        self.assertEqual(output[1], output[2])
+
+    @mock.patch("catatom2osm.app.log")
+    @mock.patch("catatom2osm.app.QueueListener")
+    @mock.patch("catatom2osm.app.ProcessPoolExecutor")
+    @mock.patch("catatom2osm.app.osmxml")
+    @mock.patch("catatom2osm.app.io")
+    @mock.patch("catatom2osm.app.os")
+    def test_get_task_executor(
+        self, m_os, m_io, m_osmxml, m_executor, m_listener, m_log
+    ):
+        m_log.app_level = logging.INFO
+        m_log.handlers = ["h1", "h2"]
+        m_os.path.exists.return_value = False
+        self.m_app.options.jobs = 3
+        source = mock.MagicMock()
+        source.__class__ = mock.MagicMock()
+        source.source_date = "2021"
+        self.m_app.get_task_executor = get_func(app.CatAtom2Osm.get_task_executor)
+        (layer, executor, listener) = self.m_app.get_task_executor(self.m_app, source)
+        fn = "33333/" + app.task_source_file
+        source.export.assert_called_once_with(fn, "GPKG", layer_name="source")
+        uri = fn + "|layername=source"
+        source.__class__.assert_called_once_with(
+            uri, providerLib="ogr", source_date="2021"
+        )
+        self.assertEqual(layer, source.__class__.return_value)
+        address_path = "33333/" + app.task_address_file
+        m_io.open.assert_called_once_with(address_path, "w", encoding="utf-8")
+        m_osmxml.serialize.assert_called_once()
+        self.assertEqual(executor, m_executor.return_value)
+        (args, kwargs) = m_executor.call_args
+        self.assertEqual(args, (3,))
+        self.assertEqual(kwargs["initializer"], app.init_task_job)
+        initargs = kwargs["initargs"]
+        self.assertEqual(
+            initargs[:5],
+            (layer.__class__, uri, "2021", address_path, self.m_app.options),
+        )
+        self.assertEqual(initargs[5:7], (config.get_user_values(), logging.INFO))
+        log_queue = initargs[7]
+        m_listener.assert_called_once_with(
+            log_queue, "h1", "h2", respect_handler_level=True
+        )
+        self.assertEqual(listener, m_listener.return_value)
+        listener.start.assert_called_once_with()
+        source.export.return_value = False
+        with self.assertRaises(CatIOError):
+            self.m_app.get_task_executor(self.m_app, source)
+
+    @mock.patch("catatom2osm.app.QgsSingleton")
+    @mock.patch("catatom2osm.app.config")
+    @mock.patch("catatom2osm.app.log")
+    def test_init_task_job(self, m_log, m_config, m_qgs):
+        handler = mock.MagicMock()
+        m_log.handlers = [handler]
+        source_class = mock.MagicMock()
+        log_queue = mock.MagicMock()
+        options = self.m_app.options
+        args = ({"parcel_dist": 5}, logging.DEBUG, log_queue)
+        app.init_task_job(source_class, "foo.gpkg", "2021", None, options, *args)
+        m_config.set_config.assert_called_once_with({"parcel_dist": 5})
+        m_log.removeHandler.assert_called_once_with(handler)
+        queue_handler = m_log.addHandler.call_args[0][0]
+        self.assertIsInstance(queue_handler, app.QueueHandler)
+        self.assertEqual(queue_handler.queue, log_queue)
+        m_log.setLevel.assert_called_once_with(logging.DEBUG)
+        self.assertEqual(m_log.app_level, logging.DEBUG)
+        source_class.assert_called_once_with(
+            "foo.gpkg", providerLib="ogr", source_date="2021"
+        )
+        self.assertEqual(app.task_job["source"], source_class.return_value)
+        self.assertIsNone(app.task_job["address_osm"])
+
+    @mock.patch("catatom2osm.app.report")
+    @mock.patch("catatom2osm.app.write_osm_file")
+    @mock.patch("catatom2osm.app.merge_address")
+    def test_write_task_job(self, m_merge, m_write, m_report):
+        source = mock.MagicMock()
+        app.task_job.update(
+            source=source,
+            options=self.m_app.options,
+            address_osm="foo",
+            address_index="bar",
+        )
+        result = app.write_task_job("123456A", [1, 2], "X", "tasks/123456A.osm.gz")
+        m_report.clear_stats.assert_called_once_with()
+        source.to_osm.assert_called_once_with(
+            upload="yes", tags={"comment": "X"}, fids=[1, 2]
+        )
+        task_osm = source.to_osm.return_value
+        m_merge.assert_called_once_with(task_osm, "foo", "bar")
+        m_report.cons_stats.assert_called_once_with(task_osm, "123456A")
+        m_write.assert_called_once_with(task_osm, "tasks/123456A.osm.gz", threads=1)
+        expected = (
+            m_write.return_value,
+            m_report.values,
+            m_report.tasks_with_fixmes,
+        )
+        self.assertEqual(result, expected)
 
     @mock.patch("catatom2osm.app.report", mock.MagicMock())
     @mock.patch("catatom2osm.app.os")
-    @mock.patch("catatom2osm.app.type")
-    def test_get_tasks(self, m_type, m_os):
+    def test_get_tasks(self, m_os):
         m_os.path.join = lambda *args: "/".join(args)
         m_os.listdir.return_value = ["1", "2", "3"]
-        layer_class = mock.MagicMock()
-        m_type.return_value = layer_class
         self.m_app.tasks = {"00001": "00001", "00002": "00001"}
         building = mock.MagicMock()
         building.get_id = lambda feat: feat["localId"]
-        building.getFeatures.return_value = [
-            {"localId": "001"},
-            {"localId": "00001"},
-            {"localId": "00002"},
-        ]
-        building.featureCount.return_value = 3
-        building.copy_feature.side_effect = [100, 101, 102]
+        features = []
+        for (fid, localid) in enumerate(["001", "00001", "00002", "001"]):
+            feat = mock.MagicMock()
+            feat.__getitem__.side_effect = {"localId": localid}.__getitem__
+            feat.id.return_value = fid
+            features.append(feat)
+        building.getFeatures.return_value = features
         self.m_app.get_tasks = get_func(app.CatAtom2Osm.get_tasks)
-        self.m_app.get_tasks(self.m_app, building)
+        tasks = self.m_app.get_tasks(self.m_app, building)
         m_os.remove.assert_has_calls(
             [
                 mock.call("33333/tasks/1"),
@@ -185,14 +566,7 @@ class TestCatAtom2Osm(unittest.TestCase):
                 mock.call("33333/tasks/3"),
             ]
         )
-        layer_class.assert_has_calls(
-            [
-                mock.call(baseName="001"),
-                mock.call().writer.addFeatures([100]),
-                mock.call(baseName="00001"),
-                mock.call().writer.addFeatures([101, 102]),
-            ]
-        )
+        self.assertEqual(tasks, {"001": [0, 3], "00001": [1, 2]})
 
     def test_process_parcel(self):
         self.m_app.tasks = {"a": "a", "b": "b", "c": "c", "d": "d", "e": "e"}
@@ -223,9 +597,16 @@ class TestCatAtom2Osm(unittest.TestCase):
         m_layer.export.return_value = True
         self.m_app.export_layer = get_func(app.CatAtom2Osm.export_layer)
         self.m_app.export_layer(self.m_app, m_layer, "bar", "taz")
-        m_layer.export.assert_called_once_with("33333/bar", "taz", target_crs_id=None)
+        m_layer.export.assert_called_once_with(
+            "33333/bar", "taz", target_crs_id=None, layer_name=None
+        )
         output = m_log.info.call_args_list[0][0][0]
         self.assertIn("Generated", output)
+        self.m_app.export_layer(self.m_app, m_layer, "bar.gpkg", "GPKG", None, "foo")
+        m_layer.export.assert_called_with(
+            "33333/bar.gpkg", "GPKG", target_crs_id=None, layer_name="foo"
+        )
+        self.assertEqual(m_log.info.call_args[0][1], "bar.gpkg|layername=foo")
         m_layer.export.return_value = False
         with self.assertRaises(CatIOError):
             self.m_app.export_layer(
@@ -258,10 +639,79 @@ class TestCatAtom2Osm(unittest.TestCase):
         output = m_log.info.call_args_list[0][0][0]
         self.assertIn("Downloading", output)
 
+    @mock.patch("catatom2osm.app.log", m_log)
+    @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    @mock.patch("catatom2osm.app.ThreadPoolExecutor", wraps=ThreadPoolExecutor)
+    @mock.patch("catatom2osm.app.osmxml")
+    @mock.patch("catatom2osm.app.os")
+    def test_add_comments(self, m_os, m_xml, m_executor):
+        m_os.path.basename = os.path.basename
+        m_os.path.exists.return_value = True
+        m_os.listdir.return_value = ["1.osm.gz", "2.osm", "tasks.csv"]
+        m_xml.update_changeset.side_effect = [0, 3]
+        self.m_app.options.jobs = 3
+        self.m_app.get_task_comment = lambda x: "X" + x
+        self.m_app.add_comments = get_func(app.CatAtom2Osm.add_comments)
+        self.m_app.add_comments(self.m_app)
+        m_executor.assert_called_once_with(3)
+        paths = [c[0][0] for c in m_xml.update_changeset.call_args_list]
+        self.assertEqual(paths, ["33333/tasks/1.osm.gz", "33333/tasks/2.osm"])
+        comments = [c[0][1]["comment"] for c in m_xml.update_changeset.call_args_list]
+        self.assertEqual(comments, ["X1", "X2"])
+        m_log.warning.assert_called_with("Check %d fixme tags", 3)
+
+    def test_current_osm_file(self):
+        self.assertEqual(app.current_osm_file("address"), "current_address.osm")
+        with mock.patch("catatom2osm.app.config.current_osm_format", "pbf"):
+            self.assertEqual(app.current_osm_file("highway"), "current_highway.pbf")
+        with mock.patch("catatom2osm.app.config.current_osm_format", "o5m"):
+            with self.assertRaises(CatConfigError):
+                app.current_osm_file("highway")
+
+    @mock.patch("catatom2osm.app.log", m_log)
+    @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    @mock.patch("catatom2osm.app.geo")
+    @mock.patch("catatom2osm.app.overpass")
+    def test_get_highway_format(self, m_overpass, m_geo):
+        def download(path, *args):
+            output = m_overpass.Query.return_value.output
+            with open(path, "w") as fo:
+                fo.write(OVERPASS_JSON if output == "json" else OVERPASS_XML)
+
+        m_overpass.Query.return_value.output = "xml"
+        m_overpass.Query.return_value.download.side_effect = download
+        self.m_app.read_osm = lambda *args, **kwargs: get_func(
+            app.CatAtom2Osm.read_osm
+        )(self.m_app, *args, **kwargs)
+        self.m_app.get_highway = get_func(app.CatAtom2Osm.get_highway)
+        read_from_osm = m_geo.HighwayLayer.return_value.read_from_osm
+        for fmt in config.current_osm_formats:
+            with tempfile.TemporaryDirectory() as path:
+                self.m_app.cat.get_path = lambda *args: os.path.join(path, *args)
+                m_overpass.Query.return_value.output = "xml"
+                m_overpass.Query.reset_mock()
+                with mock.patch("catatom2osm.app.config.current_osm_format", fmt):
+                    self.m_app.get_highway(self.m_app)
+                    self.assertEqual(
+                        os.listdir(path), ["current_highway." + fmt], msg=fmt
+                    )
+                    self.assertEqual(
+                        m_overpass.Query.return_value.output,
+                        "json" if fmt == "json" else "xml",
+                    )
+                    m_overpass.Query.assert_called_once()
+                    self.m_app.get_highway(self.m_app)
+                    m_overpass.Query.assert_called_once()
+                for ((data,), __) in read_from_osm.call_args_list[-2:]:
+                    self.assertEqual(len(data.ways), 1, msg=fmt)
+                    way = next(iter(data.ways))
+                    self.assertEqual(way.tags["name"], "Calle Mayor", msg=fmt)
+                    self.assertEqual(len(way.nodes), 2, msg=fmt)
+
     @mock.patch("catatom2osm.app.osmxml")
     @mock.patch("catatom2osm.app.codecs")
     @mock.patch("catatom2osm.app.io")
-    @mock.patch("catatom2osm.app.gzip")
+    @mock.patch("catatom2osm.app.pgzip")
     def test_write_osm(self, m_gz, m_io, m_codecs, m_xml):
         m_xml.serialize.return_value = "taz"
         data = osm.Osm()
@@ -269,6 +719,9 @@ class TestCatAtom2Osm(unittest.TestCase):
         data.Node(1, 1, {"ref": "2"})
         data.Node(2, 2)
         self.m_app.write_osm = get_func(app.CatAtom2Osm.write_osm)
+        with self.assertRaises(CatValueError):
+            self.m_app.write_osm(self.m_app, data, "bar.pbf")
+        m_io.open.assert_not_called()
         self.m_app.write_osm(self.m_app, data, "bar")
         self.assertNotIn(
             "ref", [k for el in data.elements for k in list(el.tags.keys())]
@@ -278,8 +731,8 @@ class TestCatAtom2Osm(unittest.TestCase):
         m_xml.serialize.assert_called_once_with(file_obj, data)
         m_xml.reset_mock()
         self.m_app.write_osm(self.m_app, data, "bar.gz")
-        m_gz.open.assert_called_once_with("33333/bar.gz", "w")
-        f_gz = m_gz.open.return_value
+        m_gz.GzipWriter.assert_called_once_with("33333/bar.gz", threads=None)
+        f_gz = m_gz.GzipWriter.return_value
         m_codecs.getwriter.return_value.assert_called_once_with(f_gz)
 
     @mock.patch("catatom2osm.app.cdau")
@@ -321,8 +774,7 @@ class TestCatAtom2Osm(unittest.TestCase):
         r1.append(w6, "outer")
         r1.append(w7, "outer")
         r1.append(w8, "inner")
-        self.m_app.merge_address = get_func(app.CatAtom2Osm.merge_address)
-        self.m_app.merge_address(self.m_app, building, address)
+        app.merge_address(building, address)
         self.assertNotIn("addrtags", w0.tags)
         self.assertEqual(w1.tags["addr:street"], "address1")
         self.assertNotIn("image", w1.tags)
@@ -334,9 +786,43 @@ class TestCatAtom2Osm(unittest.TestCase):
         )
         self.assertEqual(n5.tags["addr:place"], "address5")
         address.tags["source:date"] = "foobar"
-        self.m_app.merge_address(self.m_app, building, address)
+        app.merge_address(building, address)
         self.assertEqual(building.tags["source:date:addr"], address.tags["source:date"])
 
+    @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    def test_merge_address_index(self):
+        address = osm.Osm()
+        n1 = address.Node(0, 0, {"ref": "1", "addr:street": "address1"})
+        n2 = address.Node(1, 0, {"ref": "2", "addr:street": "address2"})
+        n3 = address.Node(2, 0, {"ref": "2", "addr:street": "address3"})
+        address_index = app.get_address_index(address)
+        self.assertEqual(address_index, {"1": [n1], "2": [n2, n3]})
+        building = osm.Osm()
+        w1 = building.Way([(0, 0), (1, 0), (1, 1), (0, 0)], {"ref": "1"})
+        w2 = building.Way([(1, 0), (2, 0), (2, 1), (1, 0)], {"ref": "2"})
+        app.merge_address(building, address, address_index)
+        self.assertEqual(w1.tags["addr:street"], "address1")
+        self.assertNotIn("addr:street", w2.tags)
+        self.assertEqual(list(address_index.keys()), ["1", "2"])
+
+    @mock.patch("catatom2osm.app.report", mock.MagicMock())
+    def test_merge_address_shared_entrance(self):
+        address = osm.Osm()
+        tags = {"addr:street": "address1", "entrance": "yes"}
+        address.Node(1, 0, dict(tags, ref="1"))
+        address.Node(1, 0, dict(tags, ref="2", **{"addr:street": "address2"}))
+        building = osm.Osm(node_pool=True)
+        w1 = building.Way([(0, 0), (1, 0), (1, 1), (0, 0)], {"ref": "1"})
+        w2 = building.Way([(1, 0), (2, 0), (2, 1), (1, 0)], {"ref": "2"})
+        self.assertIs(w1.nodes[1], w2.nodes[0])
+        app.merge_address(building, address)
+        self.assertIsNot(w1.nodes[1], w2.nodes[0])
+        self.assertIs(w2.nodes[0], w2.nodes[-1])
+        self.assertEqual(w1.nodes[1].tags["addr:street"], "address1")
+        self.assertEqual(w2.nodes[0].tags["addr:street"], "address2")
+        self.assertEqual(building.parents[w1.nodes[1]], {w1})
+        self.assertEqual(building.parents[w2.nodes[0]], {w2})
+
     @mock.patch("catatom2osm.app.os")
     @mock.patch("catatom2osm.app.config")
     @mock.patch("catatom2osm.app.csvtools")
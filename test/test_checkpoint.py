@@ -0,0 +1,71 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from catatom2osm import checkpoint
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, "checkpoint")
+        self.stages = [("foo", [1]), ("bar", [2]), ("taz", [3])]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def save(self, cp, stage, state=None):
+        cp.create(stage)
+        cp.save(stage, state or {})
+
+    def test_file_hash(self):
+        fn = os.path.join(self.tmp_dir, "foo.txt")
+        self.assertIsNone(checkpoint.file_hash(fn))
+        with open(fn, "w") as fo:
+            fo.write("foobar")
+        h = checkpoint.file_hash(fn)
+        self.assertEqual(h, "8843d7f92416211de9ebb963ff4ce28125932878")
+
+    def test_keys(self):
+        cp1 = checkpoint.Checkpoint(self.path, self.stages, "input")
+        cp2 = checkpoint.Checkpoint(self.path, self.stages, "input")
+        self.assertEqual(cp1.keys, cp2.keys)
+        self.assertEqual(list(cp1.keys), ["foo", "bar", "taz"])
+        stages = [("foo", [1]), ("bar", [4]), ("taz", [3])]
+        cp3 = checkpoint.Checkpoint(self.path, stages, "input")
+        self.assertEqual(cp1.keys["foo"], cp3.keys["foo"])
+        self.assertNotEqual(cp1.keys["bar"], cp3.keys["bar"])
+        self.assertNotEqual(cp1.keys["taz"], cp3.keys["taz"])
+        cp4 = checkpoint.Checkpoint(self.path, self.stages, "other")
+        self.assertNotEqual(cp1.keys["foo"], cp4.keys["foo"])
+
+    def test_save_load(self):
+        cp = checkpoint.Checkpoint(self.path, self.stages, "input")
+        self.assertIsNone(cp.last_valid(["foo", "bar", "taz"]))
+        self.save(cp, "foo", {"tasks": {"a": "b"}})
+        self.save(cp, "bar")
+        cp = checkpoint.Checkpoint(self.path, self.stages, "input")
+        self.assertEqual(cp.last_valid(["foo", "bar", "taz"]), "bar")
+        self.assertEqual(cp.last_valid(["foo"]), "foo")
+        self.assertEqual(cp.load("foo"), {"tasks": {"a": "b"}})
+
+    def test_invalidate(self):
+        cp = checkpoint.Checkpoint(self.path, self.stages, "input")
+        for stage in ("foo", "bar", "taz"):
+            self.save(cp, stage)
+        stages = [("foo", [1]), ("bar", [4]), ("taz", [3])]
+        cp = checkpoint.Checkpoint(self.path, stages, "input")
+        self.assertEqual(cp.last_valid(["foo", "bar", "taz"]), "foo")
+        self.save(cp, "bar")
+        self.assertFalse(os.path.exists(cp.get_path("taz")))
+        self.assertNotIn("taz", cp.manifest)
+        self.save(cp, "foo")
+        self.assertFalse(os.path.exists(cp.get_path("bar")))
+        self.assertEqual(list(cp.manifest), ["foo"])
+
+    def test_interrupted(self):
+        cp = checkpoint.Checkpoint(self.path, self.stages, "input")
+        self.save(cp, "foo")
+        cp.create("foo")
+        self.assertFalse(cp.is_valid("foo"))
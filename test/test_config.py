@@ -67,3 +67,10 @@ class TestConfig(unittest.TestCase):
         m_logging.getLogger().warning.called_once_with(
             "Config file '%s' not found", "taz"
         )
+
+    def test_get_user_values(self):
+        values = config.get_user_values()
+        self.assertEqual(values.keys(), config.default_user_config.keys())
+        self.assertEqual(values["parcel_dist"], config.parcel_dist)
+        with mock.patch("catatom2osm.config.parcel_dist", 5):
+            self.assertEqual(config.get_user_values()["parcel_dist"], 5)
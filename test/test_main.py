@@ -1,5 +1,6 @@
 import logging
 import os
+import tempfile
 import unittest
 from argparse import Namespace
 from test.tools import capture
@@ -36,6 +37,10 @@ class TestMain(unittest.TestCase):
             manual=False,
             path=["33333"],
             split=None,
+            jobs=1,
+            batch=1,
+            checkpoint=False,
+            sample_memory=False,
             args="33333",
         )
 
@@ -100,3 +105,84 @@ class TestMain(unittest.TestCase):
     def test_list_error(self, mocklog):
         __main__.run()
         self.assertTrue(mocklog.called)
+
+    @mock.patch(
+        "catatom2osm.__main__.sys.argv",
+        ["catatom2osm.py", "--batch", "2", "33333", "33334"],
+    )
+    @mock.patch("catatom2osm.__main__.QgsSingleton")
+    @mock.patch("catatom2osm.__main__.process_batch")
+    def test_batch(self, m_batch, m_qgs):
+        __main__.run()
+        m_qgs.assert_not_called()
+        options = m_batch.call_args[0][0]
+        self.assertEqual(options.batch, 2)
+        self.assertEqual(options.path, ["33333", "33334"])
+
+    @mock.patch.object(__main__.log, "exception", mock.MagicMock())
+    @mock.patch.object(__main__.log, "error", mock.MagicMock())
+    @mock.patch("catatom2osm.__main__.Reader")
+    @mock.patch("catatom2osm.__main__.CatAtom2Osm.create_and_run")
+    def test_process_path(self, m_run, m_reader):
+        log = __main__.log
+        handlers = list(log.handlers)
+        app_level = getattr(log, "app_level", None)
+        levels = []
+        m_run.side_effect = lambda *args: levels.append(log.app_level)
+        log.app_level = logging.DEBUG
+        try:
+            with tempfile.TemporaryDirectory() as path:
+                (a_path, elapsed, error) = __main__.process_path(path, self.options)
+                m_run.assert_called_once_with(path, self.options)
+                self.assertTrue(os.path.exists(os.path.join(path, config.log_file)))
+                self.assertEqual(levels, [logging.DEBUG])
+                self.assertEqual(log.app_level, logging.DEBUG)
+                self.assertEqual(log.handlers, handlers)
+                self.assertEqual(a_path, path)
+                self.assertIsNone(error)
+                m_run.side_effect = raiseIOError
+                (a_path, elapsed, error) = __main__.process_path(path, self.options)
+                self.assertEqual(error, "bartaz")
+                m_run.side_effect = raiseImportError
+                (a_path, elapsed, error) = __main__.process_path(path, self.options)
+                self.assertEqual(error, "ImportError: qgis")
+        finally:
+            log.app_level = app_level
+
+    @mock.patch("catatom2osm.__main__.QgsSingleton")
+    @mock.patch("catatom2osm.__main__.config")
+    @mock.patch("catatom2osm.__main__.log")
+    def test_init_worker(self, m_log, m_config, m_qgs):
+        handler = mock.MagicMock()
+        m_log.handlers = [handler]
+        __main__.init_worker({"parcel_dist": 5}, logging.DEBUG)
+        m_config.set_config.assert_called_once_with({"parcel_dist": 5})
+        m_log.removeHandler.assert_called_once_with(handler)
+        m_log.setLevel.assert_called_once_with(logging.DEBUG)
+        self.assertEqual(m_log.app_level, logging.DEBUG)
+        m_qgs.assert_called_once_with()
+
+    @mock.patch("catatom2osm.__main__.log")
+    @mock.patch("catatom2osm.__main__.config")
+    @mock.patch("catatom2osm.__main__.ProcessPoolExecutor")
+    def test_process_batch(self, m_executor, m_config, m_log):
+        m_log.app_level = logging.INFO
+        self.options.path = []
+        __main__.process_batch(self.options)
+        m_executor.assert_called_once_with(
+            1,
+            mp_context=mock.ANY,
+            initializer=__main__.init_worker,
+            initargs=(m_config.get_user_values.return_value, logging.INFO),
+        )
+        context = m_executor.call_args[1]["mp_context"]
+        self.assertEqual(context.get_start_method(), "spawn")
+
+    def test_get_summary(self):
+        results = [("33333", 3725.2, None), ("/foo/33334", 12, "bartaz")]
+        lines = __main__.get_summary(results).split("\n")
+        self.assertEqual(lines[2].split(), ["33333", "1:02:05", "Success"])
+        self.assertEqual(
+            lines[3].split(), ["/foo/33334", "0:00:12", "Failed:", "bartaz"]
+        )
+        self.assertEqual(lines[4], "2 processed, 1 failed")
@@ -2,6 +2,8 @@ import random
 import unittest
 from collections import Counter
 
+import mock
+
 from catatom2osm import osm, osmxml
 
 
@@ -15,6 +17,25 @@ class TestOsm(OsmTestCase):
         self.assertEqual(self.d.counter, 0)
         self.assertEqual(self.d.elements, set())
 
+    def test_pool_node(self):
+        d = osm.Osm(node_pool=True)
+        w1 = d.Way([(0, 0), (1, 0), (1, 1), (0, 0)])
+        w2 = d.Way([(1, 0), (2, 0), (1, 1), (1, 0)])
+        self.assertIs(w1.nodes[0], w1.nodes[-1])
+        self.assertIs(w1.nodes[1], w2.nodes[0])
+        self.assertIs(w1.nodes[2], w2.nodes[2])
+        self.assertEqual(len(d.nodes), 4)
+        self.assertEqual(d.parents[w1.nodes[1]], {w1, w2})
+        n = d.Node(2, 1)
+        self.assertIsNot(d.pool_node((2, 1)), n)
+        n20 = w2.nodes[1]
+        d.remove(w2)
+        w3 = d.Way([(2, 0), (1, 0)])
+        self.assertIsNot(w3.nodes[0], n20)
+        self.assertIs(w3.nodes[1], w1.nodes[1])
+        w4 = self.d.Way([(0, 0), (0, 0)])
+        self.assertIsNot(w4.nodes[0], w4.nodes[1])
+
     def test_getattr(self):
         n = self.d.Node(1, 1)
         self.assertEqual((n.x, n.y), (1, 1))
@@ -27,8 +48,12 @@ class TestOsm(OsmTestCase):
         w = self.d.Way([(1, 2), (2, 3), (3, 2), (1, 2)])
         r = self.d.Relation([n1, w])
         self.assertEqual(len(self.d.nodes), 6)
-        self.assertEqual(self.d.ways, [w])
-        self.assertEqual(self.d.relations, [r])
+        self.assertEqual(list(self.d.ways), [w])
+        self.assertEqual(list(self.d.relations), [r])
+        self.d.remove(r)
+        self.assertEqual(len(self.d.relations), 0)
+        self.assertEqual(len(self.d.ways), 0)
+        self.assertEqual(len(self.d.nodes), 1)
 
     def test_remove(self):
         n0 = self.d.Node(0, 0)
@@ -62,6 +87,34 @@ class TestOsm(OsmTestCase):
         self.assertEqual(len(self.d.parents[n1]), 0)
         self.assertEqual(len(self.d.elements), 0)
 
+    def test_remove_many(self):
+        n0 = self.d.Node(0, 0)
+        n1 = self.d.Node(1, 0)
+        n2 = self.d.Node(1, 1)
+        n3 = self.d.Node(0, 1)
+        n4 = self.d.Node(2, 0)
+        n5 = self.d.Node(2, 1)
+        n6 = self.d.Node(1, 0.5)
+        w1 = self.d.Way((n1, n0, n3, n2))
+        w2 = self.d.Way((n1, n6, n2))
+        w3 = self.d.Way((n1, n4, n5, n2))
+        r1 = self.d.Relation((w1, w2))
+        r2 = self.d.Relation((w2, w3))
+        self.d.remove_many([w2, r2])
+        self.assertEqual(len(self.d.elements), 6)
+        self.assertEqual(self.d.elements, {r1, w1, n0, n1, n2, n3})
+        self.assertEqual(r1.members, [osm.Relation.Member(w1)])
+        self.assertEqual(self.d.parents[n1], {w1})
+        self.assertEqual(self.d.parents[n2], {w1})
+        self.assertNotIn(w2, self.d.parents)
+        self.assertNotIn(n6, self.d.parents)
+        self.d.remove_many([n0, n1])
+        self.assertEqual(w1.nodes, [n3, n2])
+        self.assertEqual(len(self.d.elements), 4)
+        self.d.remove_many([r1])
+        self.assertEqual(len(self.d.elements), 0)
+        self.assertEqual(len(self.d.parents[n2]), 0)
+
     def test_replace(self):
         n1 = self.d.Node(1, 1)
         d2 = osm.Osm()
@@ -117,6 +170,26 @@ class TestOsm(OsmTestCase):
         self.assertEqual(r1.members[0].element.tags["x"], "y")
         self.assertEqual(r2.members[0].element.tags["x"], "y")
         self.assertNotIn(w1id, self.d.index)
+        self.assertEqual(self.d.parents[w2], {r1, r2})
+        self.assertEqual(self.d.parents[w2.nodes[0]], {w2})
+        self.assertNotIn(w1, self.d.parents)
+        self.assertNotIn(w1, self.d.ways)
+
+    def test_replace_all(self):
+        n1 = self.d.Node(1, 1)
+        n2 = self.d.Node(2, 2)
+        n3 = self.d.Node(1, 1)
+        w1 = self.d.Way([n1, n2, n1])
+        w2 = self.d.Way([n3, n2])
+        r = self.d.Relation([n3, w2])
+        self.d.replace_all({n1: n3})
+        self.assertEqual(w1.nodes, [n3, n2, n3])
+        self.assertEqual(w2.nodes, [n3, n2])
+        self.assertEqual(r.members[0].element, n3)
+        self.assertEqual(self.d.parents[n3], {w1, w2, r})
+        self.assertNotIn(n1, self.d.elements)
+        self.assertNotIn(n1, self.d.nodes)
+        self.assertEqual(n1.container, None)
 
     def test_attrs(self):
         self.assertEqual(self.d.attrs, dict(upload="never", version="0.6"))
@@ -213,6 +286,41 @@ class TestOsmElement(OsmTestCase):
         e3 = osm.Element(self.d, attrs={"id": "4"})
         self.assertEqual(e3.id, 4)
         self.assertEqual(self.d.counter, -2)
+        self.assertFalse(hasattr(e2, "__dict__"))
+        self.assertIsNone(e2._tags)
+        self.assertEqual(e2.tags, {})
+        self.assertIsNone(e2._tags)
+        tags = e2.tags
+        tags["foo"] = "bar"
+        self.assertIs(e2.tags, tags)
+        self.assertEqual(tags, {"foo": "bar"})
+        e4 = osm.Element(self.d)
+        e4.tags.setdefault("foo", "bar")
+        e4.tags.update(bar="foo")
+        self.assertEqual(e4.tags, {"foo": "bar", "bar": "foo"})
+        e2.tags = {}
+        self.assertIsNone(e2._tags)
+        e2.update_tags(foo="bar")
+        e2.update_tags({"bar": "foo"})
+        self.assertEqual(e2.tags, {"foo": "bar", "bar": "foo"})
+        e2.tags = {}
+        self.assertIsNone(e2._tags)
+
+    def test_intern_tags(self):
+        value = "".join(["ba", "r"])
+        e1 = osm.Element(self.d, {"foo": "bar"})
+        e2 = osm.Element(self.d, {"".join(["fo", "o"]): value})
+        self.assertIs(list(e1.tags)[0], list(e2.tags)[0])
+        self.assertIs(e1.tags["foo"], e2.tags["foo"])
+        e3 = osm.Element(self.d, {"foo": 1})
+        self.assertEqual(e3.tags["foo"], 1)
+
+    def test_fid(self):
+        e = osm.Element(self.d)
+        self.assertEqual(e.fid, "e-1")
+        e.id = 5
+        self.assertEqual(e.fid, "e5")
+        self.assertEqual(osm.Polygon(self.d).type, "polygon")
 
     def test_is_new(self):
         e = osm.Element(self.d)
@@ -442,6 +550,25 @@ class TestOsmWay(OsmTestCase):
         self.assertEqual(w2.geometry(), g)
         self.assertEqual(w3.geometry(), g[:4])
         self.assertEqual(w4.geometry(), w1.geometry())
+        self.assertIs(w1.geometry(), w1.geometry())
+
+    def test_geometry_changed(self):
+        w = self.d.Way([(0, 0), (1, 0), (1, 1)])
+        self.assertEqual(w.geometry(), ((0, 0), (1, 0), (1, 1)))
+        self.assertEqual(w.shoelace(), 0)
+        w.append(w.nodes[0])
+        self.assertEqual(w.geometry(), ((0, 0), (1, 0), (1, 1), (0, 0)))
+        self.assertEqual(w.shoelace(), 1)
+        n = self.d.Node(0, 1)
+        w.replace(w.nodes[2], n)
+        self.assertEqual(w.geometry(), ((0, 0), (1, 0), (0, 1), (0, 0)))
+        w.nodes = w.nodes[:2]
+        self.assertEqual(w.geometry(), ((0, 0), (1, 0)))
+        w.nodes.append(n)
+        w.changed()
+        self.assertEqual(w.geometry(), ((0, 0), (1, 0), (0, 1)))
+        w.remove(n)
+        self.assertEqual(w.geometry(), ((0, 0), (1, 0)))
 
     def test_clean_duplicated_nodes(self):
         w = self.d.Way([(0, 0), (1, 1), (1, 1), (2, 2)])
@@ -649,6 +776,18 @@ class TestOsmRelation(OsmTestCase):
         r.append(self.d.Way(w3[1:3]), "outer")
         self.assertEqual(r.outer_geometry(), [w0, w1, w2, w3, w4])
 
+    @mock.patch("catatom2osm.osm.log")
+    def test_outer_geometry_unclosed(self, m_log):
+        r = self.d.Relation()
+        w0 = ((0, 0), (1, 0), (1, 1), (0, 0))
+        r.append(self.d.Way(w0), "outer")
+        r.append(self.d.Way([(2, 0), (4, 0)]), "outer")
+        r.append(self.d.Way([(4, 0), (4, 4)]), "outer")
+        r.append(self.d.Way([(4, 4), (2, 0)]), "inner")
+        self.assertEqual(r.outer_geometry(), [w0])
+        m_log.warning.assert_called_once()
+        self.assertEqual(m_log.warning.call_args[0][1:], (r.fid, 1))
+
     def test_clone(self):
         w1 = self.d.Way([(0, 0), (1, 3), (1, 1), (0, 0)], tags={"name": "w1"})
         w2 = self.d.Way([(0, 0), (3, 2), (1, 2), (0, 0)], tags={"name": "w2"})
@@ -0,0 +1,88 @@
+import json
+import unittest
+from io import BytesIO
+
+from catatom2osm import osmjson
+
+OVERPASS = {
+    "version": 0.6,
+    "generator": "Overpass API 0.7.56.9 76e5016d",
+    "osm3s": {"timestamp_osm_base": "2021-04-03T08:38:46Z"},
+    "elements": [
+        {
+            "type": "node",
+            "id": 1,
+            "lat": 40.1,
+            "lon": -3.1,
+            "timestamp": "2017-01-01T12:00:00Z",
+            "version": 3,
+            "changeset": 123,
+            "user": "pepe",
+            "uid": 33,
+            "tags": {"addr:street": "Calle la Ñ", "addr:housenumber": "7"},
+        },
+        {"type": "node", "id": 2, "lat": 40.2, "lon": -3.1},
+        {"type": "node", "id": 3, "lat": 40.2, "lon": -3.2},
+        {
+            "type": "way",
+            "id": 10,
+            "version": 2,
+            "nodes": [1, 2, 3, 1],
+            "tags": {"building": "yes"},
+        },
+        {"type": "way", "id": 11, "nodes": [2, 3, 4]},
+        {
+            "type": "relation",
+            "id": 20,
+            "members": [
+                {"type": "way", "ref": 10, "role": "outer"},
+                {"type": "way", "ref": 11, "role": ""},
+                {"type": "node", "ref": 1, "role": "entrance"},
+            ],
+            "tags": {"type": "multipolygon", "name": "foo"},
+        },
+    ],
+}
+
+
+class OsmjsonTest(unittest.TestCase):
+    def get_file(self):
+        return BytesIO(json.dumps(OVERPASS).encode())
+
+    def test_deserialize(self):
+        result = osmjson.deserialize(self.get_file())
+        self.assertEqual(result.generator, OVERPASS["generator"])
+        self.assertEqual(result.version, "0.6")
+        self.assertEqual(len(result.nodes), 3)
+        self.assertEqual(len(result.ways), 2)
+        self.assertEqual(len(result.relations), 1)
+        n = result.get(1)
+        self.assertEqual(n.geometry(), (-3.1, 40.1))
+        self.assertEqual(n.tags["addr:street"], "Calle la Ñ")
+        self.assertEqual(n.version, "3")
+        self.assertEqual(n.changeset, "123")
+        self.assertEqual(n.uid, "33")
+        self.assertEqual(n.user, "pepe")
+        self.assertEqual(n.timestamp, "2017-01-01T12:00:00Z")
+        w = result.get(10, "w")
+        self.assertEqual([n.id for n in w.nodes], [1, 2, 3, 1])
+        self.assertEqual(w.version, "2")
+        w2 = result.get(11, "w")
+        self.assertEqual([n.id for n in w2.nodes], [2, 3])
+        r = result.get(20, "r")
+        self.assertEqual([m.element for m in r.members], [w, w2, n])
+        self.assertEqual([m.role for m in r.members], ["outer", "", "entrance"])
+        self.assertEqual(result.parents[n], {w, r})
+
+    def test_deserialize_filters(self):
+        result = osmjson.deserialize(self.get_file(), types=("way",))
+        self.assertEqual(len(result.ways), 2)
+        self.assertEqual(len(result.nodes), 3)
+        self.assertEqual(result.get(1).tags, {})
+        result = osmjson.deserialize(
+            self.get_file(),
+            query=lambda tags: "addr:street" in tags or "name" in tags,
+            geometry=False,
+        )
+        self.assertEqual(len(result.elements), 2)
+        self.assertEqual(result.get(20, "r").members, [])
@@ -0,0 +1,94 @@
+import unittest
+from io import BytesIO
+
+from catatom2osm import osm, osmpbf
+
+
+class OsmpbfTest(unittest.TestCase):
+    def test_varint(self):
+        for value in (0, 1, 127, 128, 300, 2**35, -1, -(2**40)):
+            out = bytearray()
+            osmpbf.encode_varint(value, out)
+            (result, pos) = osmpbf.decode_varint(out, 0)
+            self.assertEqual(osmpbf.decode_int64(result), value)
+            self.assertEqual(pos, len(out))
+        out = bytearray()
+        osmpbf.encode_varint(300, out)
+        self.assertEqual(out, b"\xac\x02")
+
+    def test_zigzag(self):
+        for (value, expected) in ((0, 0), (-1, 1), (1, 2), (-2, 3), (2**40, 2**41)):
+            self.assertEqual(osmpbf.zigzag(value), expected)
+            self.assertEqual(osmpbf.unzigzag(expected), value)
+
+    def test_packed(self):
+        values = [5, 3, -100, 2**33, -7]
+        out = bytearray()
+        osmpbf.encode_packed(9, values, out, signed=True, delta=True)
+        fields = osmpbf.decode_message(out)
+        result = osmpbf.decode_packed(fields[9][0], signed=True, delta=True)
+        self.assertEqual(result, values)
+
+    def test_serialize(self):
+        data = osm.Osm(generator="foobar")
+        n = data.Node(4.1234567, -0.5, {"entrance": "yes", "addr:street": "Calle la Ñ"})
+        n.version = "2"
+        n.user = "pepe"
+        n.uid = "33"
+        n.changeset = "1234"
+        n.timestamp = "2021-01-02T03:04:05Z"
+        data.Node(3.0, 0.0)
+        w = data.Way([(12.0, 0.0), (14.0, 0.0), (14.0, 2.0), n, (12.0, 0.0)])
+        w.tags["leisure"] = "swiming_pool"
+        w.tags["levels"] = 2
+        w.id = 1000
+        w.version = "3"
+        r = data.Relation(tags={"type": "multipolygon"})
+        r.append(w, "outer")
+        r.append(n)
+        r2 = data.Relation([r], {"name": "parent"})
+        fo = BytesIO()
+        osmpbf.serialize(fo, data)
+        fo.seek(0)
+        result = osmpbf.deserialize(fo)
+        self.assertEqual(result.generator, "foobar")
+        self.assertEqual(len(result.nodes), len(data.nodes))
+        self.assertEqual(len(result.ways), 1)
+        self.assertEqual(len(result.relations), 2)
+        rn = result.get(n.id)
+        self.assertEqual(rn.geometry(), n.geometry())
+        self.assertEqual(rn.tags, n.tags)
+        for attr in ("version", "user", "uid", "changeset", "timestamp"):
+            self.assertEqual(getattr(rn, attr), getattr(n, attr))
+        self.assertIsNone(result.get(-2).version)
+        self.assertEqual(result.get(-2).tags, {})
+        rw = result.get(1000, "w")
+        self.assertEqual(rw.geometry(), w.geometry())
+        self.assertEqual(rw.tags, {"leisure": "swiming_pool", "levels": "2"})
+        self.assertEqual(rw.version, "3")
+        self.assertIsNone(rw.user)
+        self.assertEqual(result.parents[rn], {rw, result.get(r.id, "r")})
+        rr = result.get(r.id, "r")
+        self.assertEqual([m.role for m in rr.members], ["outer", None])
+        self.assertEqual([m.element for m in rr.members], [rw, rn])
+        self.assertEqual(result.get(r2.id, "r").members[0].element, rr)
+
+    def test_deserialize_missing(self):
+        data = osm.Osm()
+        n = data.Node(1, 1)
+        w = data.Way([n, (2, 2)])
+        w.version = "1"
+        existing = osm.Osm()
+        existing.Node(5, 5, attrs={"id": str(n.id)})
+        data.discard(n)
+        fo = BytesIO()
+        osmpbf.serialize(fo, data)
+        fo.seek(0)
+        result = osmpbf.deserialize(fo)
+        self.assertEqual(result.get(w.id, "w").version, "2")
+        self.assertEqual(len(result.get(w.id, "w").nodes), 1)
+        fo.seek(0)
+        result = osmpbf.deserialize(fo, existing)
+        rw = result.get(w.id, "w")
+        self.assertEqual(rw.version, "1")
+        self.assertEqual(rw.nodes[0].geometry(), (5, 5))
@@ -1,11 +1,21 @@
+import gzip
+import os
+import shutil
+import tempfile
 import unittest
 from io import BytesIO, StringIO
 
-from catatom2osm import osm, osmxml
+from catatom2osm import osm, osmxml, pgzip
 from catatom2osm.osmxml import etree
 
 
 class OsmxmlTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
     def test_serialize(self):
         data = osm.Osm()
         n = data.Node(4, 0)
@@ -61,6 +71,34 @@ class OsmxmlTest(unittest.TestCase):
             self.assertEqual(xmltag.get("k"), osmtag[0])
             self.assertEqual(xmltag.get("v"), osmtag[1])
 
+    def test_serialize_as_lxml(self):
+        data = osm.Osm()
+        tags = {"name": "a&b<c>d\"e'f\ng\rh\ti ñ € 😀 ]]>", "building:levels": 2}
+        n = data.Node(4.25, 0, tags=tags)
+        n.user = "usuário"
+        n.version = "2"
+        w = data.Way([(12, 0), (14, 0), n, (12, 0)], tags={"building": "yes"})
+        r = data.Relation(tags={"type": "multipolygon"})
+        r.append(w, "outer")
+        r.append(n)
+        fo = StringIO()
+        osmxml.serialize(fo, data)
+        expected = []
+        for el in list(data.nodes) + list(data.ways) + list(data.relations):
+            e = etree.Element(el.type, el.attrs)
+            for child in getattr(el, "nodes", []):
+                e.append(etree.Element("nd", dict(ref=str(child.id))))
+            for m in getattr(el, "members", []):
+                e.append(etree.Element("member", m.attrs))
+            for key, value in el.tags.items():
+                e.append(etree.Element("tag", dict(k=key, v=str(value))))
+            expected.append(etree.tostring(e, pretty_print=True).decode())
+        body = fo.getvalue().split("\n", 2)[2]
+        self.assertEqual(body, "".join(expected) + "</osm>\n")
+        n.tags["name"] = "foo\x00bar"
+        with self.assertRaises(ValueError):
+            osmxml.serialize(StringIO(), data)
+
     def test_deserialize(self):
         attrs = dict(upload="1", version="2", generator="3")
         root = etree.Element("osm", attrs)
@@ -178,3 +216,93 @@ class OsmxmlTest(unittest.TestCase):
         self.assertEqual(len(result.relations), 3)
         self.assertEqual(result.get(-103, "w").version, "2")
         self.assertEqual(result.get(-202, "r").version, None)
+        root = etree.Element("osm")
+        wayxml = etree.Element("way", dict(id="-104", version="1"))
+        wayxml.append(etree.Element("nd", dict(ref="-50")))
+        root.append(wayxml)
+        fo = BytesIO(etree.tostring(root))
+        result = osmxml.deserialize(fo, result)
+        w = result.get(-104, "w")
+        self.assertEqual(w.nodes, [result.get(-50)])
+        self.assertEqual(w.version, "1")
+        self.assertIn(w, result.parents[result.get(-50)])
+
+    def test_update_changeset(self):
+        data = osm.Osm()
+        data.tags["comment"] = "foo"
+        data.Node(1, 1, {"fixme": "bar"})
+        data.Way([(0, 0), (1, 0), (0, 1)], {"building": "yes", "fixme": "taz"})
+        data.Node(2, 2)
+        fo = StringIO()
+        osmxml.serialize(fo, data)
+        body = fo.getvalue().split("<node", 1)[1]
+        for fn in ("task.osm", "task.osm.gz"):
+            path = os.path.join(self.tmp_dir, fn)
+            writer = pgzip.GzipWriter(path) if fn.endswith(".gz") else open(path, "wb")
+            with writer:
+                writer.write(fo.getvalue().encode())
+            tags = {"comment": "taz", "source": "cat"}
+            fixmes = osmxml.update_changeset(path, tags)
+            self.assertEqual(fixmes, 2)
+            reader = gzip.open if fn.endswith(".gz") else open
+            with reader(path, "rb") as fi:
+                output = fi.read().decode()
+            self.assertEqual(output.split("<node", 1)[1], body)
+            with reader(path, "rb") as fi:
+                result = osmxml.deserialize(fi)
+            self.assertEqual(result.tags, tags)
+            self.assertEqual(len(result.elements), len(data.elements))
+            mtime = os.stat(path).st_mtime_ns
+            self.assertEqual(osmxml.update_changeset(path, tags), 2)
+            self.assertEqual(os.stat(path).st_mtime_ns, mtime)
+
+    def test_update_changeset_error(self):
+        data = osm.Osm()
+        data.tags["comment"] = "foo"
+        for i in range(100):
+            data.Node(i, i, {"fixme": str(i)})
+        fo = StringIO()
+        osmxml.serialize(fo, data)
+        path = os.path.join(self.tmp_dir, "task.osm.gz")
+        content = gzip.compress(fo.getvalue().encode())
+        with open(path, "wb") as fo:
+            fo.write(content[:-100])
+        with self.assertRaises(EOFError):
+            osmxml.update_changeset(path, {"comment": "taz"})
+        self.assertEqual(os.listdir(self.tmp_dir), ["task.osm.gz"])
+        with open(path, "rb") as fo:
+            self.assertEqual(fo.read(), content[:-100])
+
+    def test_deserialize_filters(self):
+        data = osm.Osm()
+        n = data.Node(0, 0, {"addr:street": "foo", "addr:housenumber": "1"})
+        w1 = data.Way([(1, 1), (2, 1), n], {"name": "bar"})
+        w2 = data.Way([(3, 3), (4, 4)])
+        r = data.Relation([w1, w2], {"name": "taz"})
+        fo = StringIO()
+        osmxml.serialize(fo, data)
+        xml = fo.getvalue().encode()
+        result = osmxml.deserialize(BytesIO(xml), types=("way", "relation"))
+        self.assertEqual(len(result.ways), 2)
+        self.assertEqual(len(result.nodes), 5)
+        rw = result.get(w1.id, "w")
+        self.assertEqual(rw.geometry(), w1.geometry())
+        self.assertEqual(rw.nodes[2].tags, {})
+        self.assertIn(rw, result.parents[rw.nodes[2]])
+        self.assertEqual(len(result.get(r.id, "r").members), 2)
+        result = osmxml.deserialize(
+            BytesIO(xml), query=lambda tags: "name" in tags, types=("way",)
+        )
+        self.assertEqual(len(result.elements), 4)
+        self.assertEqual(result.get(w1.id, "w").geometry(), w1.geometry())
+        result = osmxml.deserialize(
+            BytesIO(xml), query=lambda tags: "addr:street" in tags, geometry=False
+        )
+        self.assertEqual(len(result.elements), 1)
+        self.assertEqual(result.get(n.id).tags, n.tags)
+        result = osmxml.deserialize(
+            BytesIO(xml), query=lambda tags: "name" in tags, geometry=False
+        )
+        self.assertEqual(len(result.elements), 2)
+        self.assertEqual(result.get(w1.id, "w").nodes, [])
+        self.assertEqual(result.get(r.id, "r").members, [])
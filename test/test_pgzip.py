@@ -0,0 +1,71 @@
+import gzip
+import os
+import unittest
+from io import BytesIO
+
+import mock
+
+from catatom2osm import pgzip
+
+
+class TestGzipWriter(unittest.TestCase):
+    def get_data(self):
+        return b"".join(b"<node id='%d'/>\n" % i for i in range(5000))
+
+    def test_write(self):
+        data = self.get_data()
+        for threads in (1, 4):
+            fo = BytesIO()
+            fo.close = mock.MagicMock()
+            writer = pgzip.GzipWriter(fo, level=1, threads=threads, block_size=1000)
+            for i in range(0, len(data), 333):
+                writer.write(data[i : i + 333])
+            writer.close()
+            fo.close.assert_not_called()
+            output = fo.getvalue()
+            self.assertEqual(gzip.decompress(output), data)
+            members = output.count(b"\x1f\x8b\x08\x00\x00\x00\x00\x00")
+            self.assertEqual(members, -(-len(data) // 1000))
+
+    def test_executor(self):
+        data = self.get_data()
+        pgzip.executors.clear()
+        writer = pgzip.GzipWriter(BytesIO(), threads=3, block_size=len(data))
+        writer.write(data[:-1])
+        writer.close()
+        self.assertEqual(pgzip.executors, {})
+        for i in range(2):
+            writer = pgzip.GzipWriter(BytesIO(), threads=3, block_size=1000)
+            writer.write(data)
+            writer.close()
+        self.assertEqual(len(pgzip.executors), 1)
+        executor = pgzip.get_executor(3)
+        self.assertIs(pgzip.executors[(os.getpid(), 3)], executor)
+        self.assertEqual(executor._max_workers, 3)
+
+    def test_write_empty(self):
+        fo = BytesIO()
+        pgzip.GzipWriter(fo, threads=2).close()
+        self.assertEqual(gzip.decompress(fo.getvalue()), b"")
+        self.assertGreater(len(fo.getvalue()), 0)
+
+    def test_flush(self):
+        fo = BytesIO()
+        writer = pgzip.GzipWriter(fo, threads=2, block_size=1000)
+        writer.write(b"x" * 500)
+        writer.flush()
+        self.assertEqual(fo.getvalue(), b"")
+        writer.close()
+        self.assertEqual(gzip.decompress(fo.getvalue()), b"x" * 500)
+        with self.assertRaises(ValueError):
+            writer.write(b"x")
+
+    @mock.patch("catatom2osm.pgzip.config")
+    def test_config(self, m_config):
+        m_config.compresslevel = 9
+        m_config.compress_threads = 0
+        with mock.patch("catatom2osm.pgzip.os.cpu_count", return_value=3):
+            writer = pgzip.GzipWriter(BytesIO())
+        self.assertEqual(writer.level, 9)
+        self.assertEqual(writer.threads, 3)
+        writer.close()
@@ -1,6 +1,8 @@
 import io
+import json
 import locale
 import os
+import time
 import unittest
 from collections import Counter
 from datetime import datetime
@@ -8,6 +10,7 @@ from datetime import datetime
 import mock
 
 from catatom2osm import config, osm, report
+from catatom2osm.report import TAB
 
 os.environ["LANGUAGE"] = "C"
 config.install_gettext("catato2osm", "")
@@ -245,6 +248,28 @@ class TestReport(unittest.TestCase):
         self.assertEqual(r.fixme_counter["f1"], 1)
         self.assertEqual(r.fixme_counter["f2"], 2)
 
+    def test_add_stats(self):
+        r = report.Report()
+        r.inc("nodes", 5)
+        r.building_counter["a"] = 1
+        worker = report.Report()
+        worker.inc("nodes", 9)
+        worker.clear_stats()
+        data = osm.Osm()
+        data.Node(0, 0, {"building": "a", "fixme": "f1"})
+        data.Node(0, 0, {"building": "b"})
+        worker.cons_stats(data, "t1")
+        worker.osm_stats(data)
+        worker.warnings.append("w1")
+        self.assertNotIn("date", worker.values)
+        r.add_stats(worker.values, worker.tasks_with_fixmes)
+        self.assertEqual(r.nodes, 7)
+        self.assertEqual(r.out_buildings, 2)
+        self.assertEqual(r.building_counter, Counter({"a": 2, "b": 1}))
+        self.assertEqual(r.fixme_counter, Counter({"f1": 1}))
+        self.assertEqual(r.tasks_with_fixmes, Counter({"t1": 1}))
+        self.assertEqual(r.warnings, ["w1"])
+
     def test_fixme_stats(self):
         r = report.Report()
         r.fixme_counter = {}
@@ -255,6 +280,113 @@ class TestReport(unittest.TestCase):
         self.assertEqual(r.fixme_stats(), 3)
         self.assertEqual(len(r.fixmes), 2)
 
+    def test_stage(self):
+        r = report.Report()
+        layer = mock.MagicMock()
+        layer.name.return_value = "foo"
+        layer.featureCount.return_value = 3
+        app = mock.MagicMock(spec=[])
+        app.building = layer
+        with r.stage("bar", app):
+            with r.stage("taz"):
+                sum(range(10000))
+        self.assertEqual([e["name"] for e in r.stages], ["bar", "taz"])
+        self.assertEqual([e["level"] for e in r.stages], [0, 1])
+        self.assertEqual(r.stages[0]["features"], {"building": 3})
+        self.assertNotIn("features", r.stages[1])
+        for k in ("start", "wall", "cpu", "peak_rss"):
+            self.assertGreaterEqual(r.stages[0][k], 0)
+        self.assertEqual(r.active_stages, [])
+        with self.assertRaises(ValueError):
+            with r.stage("xyz"):
+                raise ValueError
+        self.assertIn("wall", r.stages[-1])
+        self.assertEqual(r.active_stages, [])
+
+    def test_profile(self):
+        r = report.Report()
+
+        @r.profile
+        def method(layer, foo):
+            return foo
+
+        layer = mock.MagicMock()
+        layer.name.return_value = "building"
+        layer.featureCount.return_value = 5
+        self.assertEqual(method(layer, "bar"), "bar")
+        self.assertEqual(r.stages[0]["name"], "building.method")
+        self.assertEqual(r.stages[0]["features"], {"building": 5})
+
+    def test_profile_stats(self):
+        r = report.Report()
+        r.stages = [
+            {"name": "foo", "level": 0, "start": 0, "wall": 2, "cpu": 1.5},
+            {"name": "bar", "level": 1, "start": 0.5, "wall": 1, "cpu": 1},
+            {"name": "taz", "level": 0, "start": 2},
+        ]
+        r.stages[0]["peak_rss"] = 10
+        r.stages[0]["features"] = {"building": 1000}
+        r.stages[1]["peak_rss"] = 0
+        r.profile_stats()
+        self.assertEqual(r.timeline, r.stages)
+        self.assertEqual(len(r.profile_stages), 2)
+        line = r.profile_stages[0]
+        self.assertTrue(line.startswith("foo: 2.0 s, CPU 1.5 s, +10.0 MB, building"))
+        self.assertEqual(r.profile_stages[1], TAB + "bar: 1.0 s, CPU 1.0 s, +0.0 MB")
+        output = r.to_string()
+        self.assertIn("=Profile=", output)
+
+    def test_sampler(self):
+        r = report.Report()
+        r.start_sampler(0.001)
+        with r.stage("foo"):
+            with r.stage("bar"):
+                data = bytearray(50 * 1024 * 1024)
+                time.sleep(0.05)
+                del data
+        r.profile_stats()
+        self.assertIsNone(r.sampler)
+        self.assertGreater(r.peak_rss, 0)
+        self.assertEqual(r.peak_stage, "foo/bar")
+        self.assertGreater(len(r.memory_samples), 1)
+        self.assertLessEqual(len(r.memory_samples), report.MAX_SAMPLES)
+        self.assertIn("Peak physical memory usage", r.to_string())
+
+    @mock.patch("catatom2osm.report.MAX_SAMPLES", 10)
+    def test_sampler_decimate(self):
+        r = report.Report()
+        r.start_sampler(0.001)
+        time.sleep(0.1)
+        sampler = r.sampler
+        r.stop_sampler()
+        self.assertLess(len(r.memory_samples), 10)
+        self.assertGreater(sampler.interval, 0.001)
+
+    def test_clear_sampler(self):
+        r = report.Report()
+        r.start_sampler(0.001)
+        time.sleep(0.01)
+        r.clear_sampler()
+        self.assertIsNone(r.sampler)
+        self.assertNotIn("peak_rss", r.values)
+        self.assertNotIn("memory_samples", r.values)
+
+    @mock.patch("catatom2osm.report.open")
+    def test_export_timeline(self, m_open):
+        r = report.Report()
+        r.stages = [
+            {"name": "foo", "level": 0, "start": 0.5, "wall": 2, "cpu": 1.5},
+        ]
+        r.export_timeline("timeline.json")
+        m_open.assert_called_once_with("timeline.json", "w")
+        fo = m_open.return_value.__enter__.return_value
+        output = json.loads("".join(c[0][0] for c in fo.write.call_args_list))
+        event = output["traceEvents"][0]
+        self.assertEqual(event["name"], "foo")
+        self.assertEqual(event["ts"], 500000)
+        self.assertEqual(event["dur"], 2000000)
+        self.assertEqual(event["args"], {"cpu": 1.5})
+
     @mock.patch("catatom2osm.report.open")
     def test_from_file(self, m_open):
         r = report.Report()
@@ -276,3 +408,15 @@ class TestReport(unittest.TestCase):
         self.assertEqual(r.app_version, "taz")
         self.assertEqual(r.building_date, "2021-06-22")
         self.assertEqual(r.address_date, "2021-09-11")
+        r.options = "-b 12345"
+        r.peak_rss = 100
+        fo.read.return_value = (
+            '{"options": "foo", "peak_rss": 50, "profile_stages": []}'
+        )
+        r.from_file("")
+        self.assertEqual(r.options, "foo")
+        self.assertEqual(r.peak_rss, 100)
+        self.assertNotIn("profile_stages", r.values)
+        r.options = "-b 12345"
+        r.from_file("", keep=report.RUN_KEYS)
+        self.assertEqual(r.options, "-b 12345")